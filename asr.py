@@ -7,6 +7,7 @@ import time
 import dashscope
 from dashscope.audio.qwen_omni import *
 from dashscope.audio.qwen_omni.omni_realtime import TranscriptionParams
+from endpoints import get_selector
 
 
 def setup_logging():
@@ -37,11 +38,12 @@ class MyCallback(OmniRealtimeCallback):
         self.conversation = conversation
         self.results = []
         self.on_text_callback = None
+        self.on_speech_start_callback = None
         self.handlers = {
             'session.created': self._handle_session_created,
             'conversation.item.input_audio_transcription.completed': self._handle_final_text,
             'conversation.item.input_audio_transcription.text': self._handle_stash_text,
-            'input_audio_buffer.speech_started': lambda r: print('======Speech Start======'),
+            'input_audio_buffer.speech_started': self._handle_speech_started,
             'input_audio_buffer.speech_stopped': lambda r: print('======Speech Stop======')
         }
 
@@ -69,6 +71,12 @@ class MyCallback(OmniRealtimeCallback):
         if self.on_text_callback:
             self.on_text_callback(text)
 
+    def _handle_speech_started(self, response):
+        started_at = time.perf_counter()
+        print('======Speech Start======')
+        if self.on_speech_start_callback:
+            self.on_speech_start_callback(started_at)
+
     def _handle_stash_text(self, response):
         print(f"Got stash result: {response['stash']}")
 
@@ -114,9 +122,10 @@ class ASRClient:
 
         print("[ASR] Connecting...")
         self.callback = MyCallback(conversation=None)
+        # 地域由测速结果决定，见 endpoints.py
         self.conversation = OmniRealtimeConversation(
             model='qwen3-asr-flash-realtime',
-            url='wss://dashscope.aliyuncs.com/api-ws/v1/realtime',
+            url=get_selector().ws_url(),
             callback=self.callback
         )
         self.conversation.callback.conversation = self.conversation
@@ -137,6 +146,11 @@ class ASRClient:
         if self.callback:
             self.callback.on_text_callback = callback_func
 
+    def set_speech_start_callback(self, callback_func):
+        """检测到新语音开始时回调，参数为事件到达时间 (perf_counter)"""
+        if self.callback:
+            self.callback.on_speech_start_callback = callback_func
+
     def start_stream(self):
         """Start a streaming session"""
         if not self.conversation:
@@ -212,8 +226,8 @@ def main():
     audio_file_path = "./your_audio_file.pcm"
     conversation = OmniRealtimeConversation(
         model='qwen3-asr-flash-realtime',
-        # 以下为北京地域url，若使用新加坡地域的模型，需将url替换为：wss://dashscope-intl.aliyuncs.com/api-ws/v1/realtime
-        url='wss://dashscope.aliyuncs.com/api-ws/v1/realtime',
+        # 地域由测速结果决定，见 endpoints.py
+        url=get_selector().ws_url(),
         callback=MyCallback(conversation=None)  # 暂时传None，稍后注入
     )
 
@@ -0,0 +1,157 @@
+# coding=utf-8
+"""
+进程级音频设备管理。
+
+整个进程只持有一个 PyAudio 实例，每个 (输出设备, 采样率) 对应一个长期打开的回调模式输出流。
+TTS 回调从这里借用输出流而不是每次连接都重新打开设备；空闲时回调持续输出静音，
+设备保持预热，重连或重新开始时不再付出打开设备的延迟，也不会丢掉开头的音频。
+"""
+import atexit
+import threading
+
+import pyaudio
+
+DEFAULT_BLOCK_MS = 20        # 设备回调块长
+DEFAULT_MAX_BUFFER_MS = 100  # write() 最多预先缓冲的音频，超过时阻塞
+
+
+class OutputStream:
+    """
+    长期打开的输出流。write() 把 PCM 放入缓冲区，PortAudio 回调从中取数据，
+    缓冲区为空时输出静音
+    """
+    def __init__(self, pa, device_index=None, rate=24000, channels=1,
+                 block_ms=DEFAULT_BLOCK_MS, max_buffer_ms=DEFAULT_MAX_BUFFER_MS):
+        self.device_index = device_index
+        self.rate = rate
+        self.channels = channels
+        self.bytes_per_second = rate * channels * 2
+        self.max_buffer_bytes = self.bytes_per_second * max_buffer_ms // 1000
+        self.underruns = 0
+        self._buf = bytearray()
+        self._active = False  # 是否处于一句话的播放过程中 (用于统计欠载)
+        self._closed = False
+        self._cond = threading.Condition()
+        self._stream = pa.open(format=pyaudio.paInt16,
+                               channels=channels,
+                               rate=rate,
+                               output=True,
+                               output_device_index=device_index,
+                               frames_per_buffer=rate * block_ms // 1000,
+                               stream_callback=self._callback)
+        self._stream.start_stream()
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        n = frame_count * self.channels * 2
+        with self._cond:
+            if len(self._buf) >= n:
+                out = bytes(self._buf[:n])
+                del self._buf[:n]
+            else:
+                if self._active:
+                    self.underruns += 1
+                # 不足的部分补静音，保持设备持续运行
+                out = bytes(self._buf) + bytes(n - len(self._buf))
+                self._buf.clear()
+            self._cond.notify_all()
+        return (out, pyaudio.paContinue)
+
+    def write(self, data):
+        """写入 PCM，缓冲区超过上限时阻塞，保持与实时播放同步"""
+        with self._cond:
+            self._cond.wait_for(lambda: len(self._buf) <= self.max_buffer_bytes or self._closed)
+            if not self._closed:
+                self._buf += data
+
+    def flush(self):
+        """丢弃尚未播放的缓冲音频"""
+        with self._cond:
+            self._buf.clear()
+            self._cond.notify_all()
+
+    def drain(self, timeout=None):
+        """等待缓冲区播放完毕"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not self._buf or self._closed, timeout)
+
+    def mark_active(self, active):
+        """标记一句话开始/结束播放，只有播放过程中缓冲区耗尽才计为欠载"""
+        self._active = active
+
+    def buffered_seconds(self):
+        with self._cond:
+            return len(self._buf) / self.bytes_per_second
+
+    def get_output_latency(self):
+        """设备自身的输出延迟 (秒)，不含 write() 缓冲区"""
+        return self._stream.get_output_latency()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        self._stream.stop_stream()
+        self._stream.close()
+
+
+class AudioDeviceManager:
+    def __init__(self):
+        self._pa = None
+        self._streams = {}
+        self._users = {}
+        self._lock = threading.Lock()
+
+    @property
+    def pa(self):
+        """进程内共享的 PyAudio 实例"""
+        with self._lock:
+            if self._pa is None:
+                self._pa = pyaudio.PyAudio()
+            return self._pa
+
+    def output_stream(self, device_index=None, rate=24000, channels=1):
+        """借用 (device_index, rate, channels) 对应的输出流，不存在时打开并保持预热"""
+        pa = self.pa
+        key = (device_index, rate, channels)
+        with self._lock:
+            stream = self._streams.get(key)
+            if stream is None:
+                stream = OutputStream(pa, device_index, rate, channels)
+                self._streams[key] = stream
+                print(f'[Audio] 输出设备已打开: device={device_index}, rate={rate}')
+            self._users[key] = self._users.get(key, 0) + 1
+            return stream
+
+    def release(self, stream):
+        """归还输出流。流保持打开并输出静音，供下次借用"""
+        key = (stream.device_index, stream.rate, stream.channels)
+        with self._lock:
+            if self._users.get(key, 0) > 0:
+                self._users[key] -= 1
+        stream.mark_active(False)
+
+    def underruns(self):
+        """所有输出流的欠载次数之和"""
+        with self._lock:
+            return sum(s.underruns for s in self._streams.values())
+
+    def shutdown(self):
+        with self._lock:
+            streams, self._streams = list(self._streams.values()), {}
+            self._users.clear()
+            pa, self._pa = self._pa, None
+        for stream in streams:
+            try:
+                stream.close()
+            except Exception as e:
+                print(f'[Audio] 关闭输出流失败: {e}')
+        if pa:
+            pa.terminate()
+
+
+_manager = AudioDeviceManager()
+atexit.register(_manager.shutdown)
+
+
+def get_manager():
+    return _manager
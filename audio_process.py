@@ -0,0 +1,548 @@
+# coding=utf-8
+"""
+独立音频进程模式。
+
+麦克风采集和扬声器播放在单独的子进程中运行，PortAudio 回调不再与 Tk、ASR/TTS 客户端
+和 SDK websocket 线程争抢主进程的 GIL。两个进程之间通过 multiprocessing.shared_memory
+上的单生产者/单消费者环形缓冲区交换 PCM；统计计数和播放状态放在共享内存的状态块中，
+清空播放通过环形缓冲区头部的丢弃位置完成，热路径上不经过 Pipe。Pipe 只用于启动和停止。
+
+主进程一侧的接口与单进程模式保持一致:
+- AudioProcess.read() / stats() / stop() 同 capture.CaptureEngine
+- AudioProcess.output_stream() 返回的对象同 audio_devices.OutputStream
+
+直接运行本文件可在 GIL 压力下对比两种模式的卡顿计数 (需要真实的音频设备):
+    python audio_process.py --seconds 20
+"""
+import argparse
+import base64
+import contextlib
+import json
+import multiprocessing
+import struct
+import threading
+import time
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from capture import CapturedFrame
+
+# 环形缓冲区头部: capacity, write_pos, read_pos, discard_to (uint64)。
+# 位置单调递增，只由各自一侧更新 (discard_to 由生产者更新)；对齐的 8 字节写入在常见平台上不会被读到一半。
+HEADER_BYTES = 32
+TIMESTAMP_BYTES = 8
+# 状态块字段 (uint64): active 由主进程写入，其余计数由子进程写入
+STATUS_FIELDS = ('active', 'frames', 'input_overflows', 'overruns', 'gaps', 'underruns')
+START_TIMEOUT = 10.0
+STOP_TIMEOUT = 2.0
+WRITE_TIMEOUT = 2.0  # 播放缓冲区持续写不进去的最长时间，超过后丢弃该段音频
+POLL_INTERVAL = 0.005
+
+
+def _close_shm(shm, owner, views):
+    """释放本对象导出的 memoryview 后关闭共享内存，owner 为 True 时同时删除"""
+    for view in views:
+        view.release()
+    try:
+        shm.close()
+    except BufferError:
+        # 调用方在帧之外另建了 memoryview: 映射在这些引用回收后才能解除
+        print(f'[Warning] 共享内存 {shm.name} 仍被引用，暂不关闭')
+    if owner:
+        shm.unlink()
+
+
+class SharedRing:
+    """共享内存上的单生产者/单消费者字节环形缓冲区"""
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self._owner = owner
+        self._idx = shm.buf[:HEADER_BYTES].cast('Q')
+        self.capacity = self._idx[0]
+        self._data = shm.buf[HEADER_BYTES:HEADER_BYTES + self.capacity]
+        self._exports = []  # peek() 返回的视图，advance()/close() 时释放
+
+    @classmethod
+    def create(cls, capacity):
+        shm = shared_memory.SharedMemory(create=True, size=HEADER_BYTES + capacity)
+        idx = shm.buf[:HEADER_BYTES].cast('Q')
+        idx[0], idx[1], idx[2], idx[3] = capacity, 0, 0, 0
+        idx.release()
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def _read_pos(self):
+        # 生产者请求丢弃的数据视为已读
+        return max(self._idx[2], self._idx[3])
+
+    def used(self):
+        return self._idx[1] - self._read_pos()
+
+    def free(self):
+        return self.capacity - self.used()
+
+    def write(self, *parts):
+        """(生产者) 写入若干段数据，空间不足时整体放弃并返回 False"""
+        total = sum(len(p) for p in parts)
+        if total > self.free():
+            return False
+        pos = self._idx[1]
+        for part in parts:
+            view = memoryview(part).cast('B')
+            offset = pos % self.capacity
+            first = min(len(view), self.capacity - offset)
+            self._data[offset:offset + first] = view[:first]
+            if first < len(view):
+                self._data[:len(view) - first] = view[first:]
+            pos += len(view)
+        # 数据写完后再发布写位置
+        self._idx[1] = pos
+        return True
+
+    def read_into(self, out):
+        """(消费者) 读取最多 len(out) 字节，返回实际读取的字节数"""
+        pos = self._read_pos()
+        n = min(len(out), self._idx[1] - pos)
+        offset = pos % self.capacity
+        first = min(n, self.capacity - offset)
+        out[:first] = self._data[offset:offset + first]
+        if first < n:
+            out[first:n] = self._data[:n - first]
+        self._idx[2] = pos + n
+        return n
+
+    def peek(self, n, split=0):
+        """
+        (消费者) 不拷贝地查看接下来的 n 字节，要求不跨越缓冲区末尾。
+        返回的视图在 advance() 或 close() 时失效；split 非 0 时返回在该处切开的两个视图
+        """
+        offset = self._read_pos() % self.capacity
+        views = [self._data[offset:offset + n]]
+        if split:
+            views = [self._data[offset:offset + split], self._data[offset + split:offset + n]]
+        self._exports.extend(views)
+        return views if split else views[0]
+
+    def advance(self, n):
+        """(消费者) 释放 n 字节，之前 peek() 返回的视图随之失效"""
+        self._release_exports()
+        self._idx[2] = self._read_pos() + n
+
+    def request_discard(self):
+        """(生产者) 丢弃目前已写入但尚未播放的数据，之后写入的数据不受影响"""
+        self._idx[3] = self._idx[1]
+
+    def _release_exports(self):
+        for view in self._exports:
+            view.release()
+        self._exports.clear()
+
+    def close(self):
+        self._release_exports()
+        _close_shm(self.shm, self._owner, (self._data, self._idx))
+
+
+class SharedStatus:
+    """共享内存上的状态块 (STATUS_FIELDS)，每个字段只由一侧写入，读取无需经过 Pipe"""
+    _INDEX = {name: i for i, name in enumerate(STATUS_FIELDS)}
+
+    def __init__(self, shm, owner):
+        self.shm = shm
+        self._owner = owner
+        self._values = shm.buf[:8 * len(STATUS_FIELDS)].cast('Q')
+
+    @classmethod
+    def create(cls):
+        shm = shared_memory.SharedMemory(create=True, size=8 * len(STATUS_FIELDS))
+        shm.buf[:8 * len(STATUS_FIELDS)] = bytes(8 * len(STATUS_FIELDS))
+        return cls(shm, owner=True)
+
+    @classmethod
+    def attach(cls, name):
+        return cls(shared_memory.SharedMemory(name=name), owner=False)
+
+    @property
+    def name(self):
+        return self.shm.name
+
+    def get(self, field):
+        return self._values[self._INDEX[field]]
+
+    def set(self, field, value):
+        self._values[self._INDEX[field]] = value
+
+    def add(self, field, n=1):
+        self._values[self._INDEX[field]] += n
+
+    def counters(self):
+        return {name: self._values[i] for i, name in enumerate(STATUS_FIELDS) if name != 'active'}
+
+    def close(self):
+        _close_shm(self.shm, self._owner, (self._values,))
+
+
+# ======= 子进程 =======
+def _run_audio_process(conn, capture_name, playback_name, status_name, cfg):
+    """子进程入口: 运行采集/播放回调，直到收到停止命令"""
+    import pyaudio
+
+    capture = SharedRing.attach(capture_name)
+    playback = SharedRing.attach(playback_name)
+    shared = SharedStatus.attach(status_name)
+    frame_bytes = cfg['chunk'] * 2
+    frame_duration = cfg['chunk'] / cfg['rate']
+    state = {'last_timestamp': None}
+
+    def on_input(in_data, frame_count, time_info, status):
+        now = time.time()
+        if status & pyaudio.paInputOverflow:
+            shared.add('input_overflows')
+        adc_time = time_info.get('input_buffer_adc_time', 0)
+        current_time = time_info.get('current_time', 0)
+        timestamp = now - (current_time - adc_time) if adc_time and current_time else now
+        last = state['last_timestamp']
+        if last is not None and timestamp - last > frame_duration * 1.5:
+            shared.add('gaps')
+        state['last_timestamp'] = timestamp
+        shared.add('frames')
+        data = in_data if len(in_data) == frame_bytes else in_data[:frame_bytes].ljust(frame_bytes, b'\0')
+        if not capture.write(struct.pack('d', timestamp), data):
+            shared.add('overruns')
+        return (None, pyaudio.paContinue)
+
+    def on_output(in_data, frame_count, time_info, status):
+        out = bytearray(frame_count * 2)
+        got = playback.read_into(memoryview(out))
+        if got < len(out) and shared.get('active'):
+            shared.add('underruns')
+        return (bytes(out), pyaudio.paContinue)
+
+    pa = pyaudio.PyAudio()
+    streams = []
+    try:
+        streams.append(pa.open(format=pyaudio.paInt16, channels=1, rate=cfg['rate'], input=True,
+                               input_device_index=cfg['input_device_index'],
+                               frames_per_buffer=cfg['chunk'], stream_callback=on_input))
+        out_stream = pa.open(format=pyaudio.paInt16, channels=1, rate=cfg['output_rate'], output=True,
+                             output_device_index=cfg['output_device_index'],
+                             frames_per_buffer=cfg['output_rate'] * cfg['block_ms'] // 1000,
+                             stream_callback=on_output)
+        streams.append(out_stream)
+        for s in streams:
+            s.start_stream()
+        conn.send(('ready', {'output_latency': out_stream.get_output_latency()}))
+
+        while True:
+            # 主进程退出时 Pipe 关闭，recv() 抛出 EOFError，子进程随之结束
+            cmd, _ = conn.recv()
+            if cmd == 'stop':
+                break
+    except EOFError:
+        pass
+    except Exception as e:
+        try:
+            conn.send(('error', str(e)))
+        except OSError:
+            pass
+    finally:
+        for s in streams:
+            s.stop_stream()
+            s.close()
+        pa.terminate()
+        capture.close()
+        playback.close()
+        shared.close()
+
+
+# ======= 主进程接口 =======
+class PlaybackProxy:
+    """子进程播放通道，接口同 audio_devices.OutputStream"""
+    def __init__(self, owner, rate, max_buffer_ms):
+        self._owner = owner
+        self.rate = rate
+        self.bytes_per_second = rate * 2
+        self.max_buffer_bytes = self.bytes_per_second * max_buffer_ms // 1000
+
+    @property
+    def _ring(self):
+        return self._owner._playback
+
+    @property
+    def underruns(self):
+        return self._owner.stats().get('underruns', 0)
+
+    def write(self, data):
+        """
+        缓冲超过上限时阻塞等待子进程播放。子进程已退出或 WRITE_TIMEOUT 内一直写不进去时
+        丢弃该段音频并返回，调用线程不会一直等待
+        """
+        data = memoryview(data).cast('B')
+        deadline = None
+        with self._owner._access() as ok:
+            while ok and self._owner.running:
+                if self._ring.used() <= self.max_buffer_bytes and self._ring.free() >= len(data):
+                    self._ring.write(data)
+                    return
+                if not self._owner.alive():
+                    self._owner._report_dead()
+                    return
+                if deadline is None:
+                    deadline = time.monotonic() + WRITE_TIMEOUT
+                elif time.monotonic() >= deadline:
+                    print(f'[Warning] 音频进程 {WRITE_TIMEOUT:.0f}s 内没有消费播放数据，丢弃 {len(data)} 字节')
+                    return
+                time.sleep(POLL_INTERVAL)
+
+    def flush(self):
+        """丢弃已写入但尚未播放的音频。立即生效，之后写入的音频 (下一句) 不会被丢弃"""
+        with self._owner._access() as ok:
+            if ok:
+                self._ring.request_discard()
+
+    def drain(self, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._owner._access() as ok:
+            while ok and self._owner.alive() and self._ring.used():
+                if deadline is not None and time.monotonic() >= deadline:
+                    return False
+                time.sleep(POLL_INTERVAL)
+        return True
+
+    def mark_active(self, active):
+        with self._owner._access() as ok:
+            if ok:
+                self._owner._status.set('active', int(active))
+
+    def buffered_seconds(self):
+        with self._owner._access() as ok:
+            if not ok:
+                return 0.0
+            return self._ring.used() / self.bytes_per_second
+
+    def get_output_latency(self):
+        return self._owner.output_latency
+
+
+class AudioProcess:
+    """
+    在子进程中运行采集和播放。read()/stats()/stop() 与 capture.CaptureEngine 相同，
+    output_stream() 返回供 TTS 使用的播放通道
+    """
+    def __init__(self, rate=16000, chunk=3200, input_device_index=None, output_device_index=None,
+                 output_rate=24000, capture_slots=32, playback_seconds=2.0,
+                 block_ms=20, max_buffer_ms=200):
+        self.rate = rate
+        self.chunk = chunk
+        self.output_rate = output_rate
+        self.max_buffer_ms = max_buffer_ms
+        self.frame_bytes = chunk * 2
+        self.record_bytes = TIMESTAMP_BYTES + self.frame_bytes
+        self.capture_slots = capture_slots
+        self.playback_seconds = playback_seconds
+        self.output_latency = 0.0
+        self.running = False
+        self._cfg = {'rate': rate, 'chunk': chunk, 'output_rate': output_rate, 'block_ms': block_ms,
+                     'input_device_index': input_device_index, 'output_device_index': output_device_index}
+        self._capture = None
+        self._playback = None
+        self._status = None
+        self._conn = None
+        self._process = None
+        # 正在访问共享内存的线程数，stop() 等其归零后才关闭共享内存
+        self._users = 0
+        self._users_cond = threading.Condition()
+        self._held = False
+        self._seq = 0
+        self._last_stats = {}
+        self._dead_reported = False
+
+    def start(self):
+        if self.running:
+            return
+        # 采集缓冲区容量是整帧的倍数，帧不会跨越末尾，可以零拷贝读取
+        self._capture = SharedRing.create(self.record_bytes * self.capture_slots)
+        self._playback = SharedRing.create(int(self.output_rate * 2 * self.playback_seconds))
+        self._status = SharedStatus.create()
+        self._held = False
+        self._dead_reported = False
+        self._conn, child_conn = multiprocessing.Pipe()
+        self._process = multiprocessing.Process(
+            target=_run_audio_process,
+            args=(child_conn, self._capture.name, self._playback.name, self._status.name, self._cfg),
+            name='AudioProcess', daemon=True)
+        self._process.start()
+        if not self._conn.poll(START_TIMEOUT):
+            self._process.terminate()
+            self._close_rings()
+            raise RuntimeError('音频进程启动超时')
+        kind, info = self._conn.recv()
+        if kind != 'ready':
+            self._process.join()
+            self._close_rings()
+            raise RuntimeError(f'音频进程启动失败: {info}')
+        self.output_latency = info['output_latency']
+        self.running = True
+        print(f'[Audio] 音频进程已启动 (pid {self._process.pid})')
+
+    @contextlib.contextmanager
+    def _access(self):
+        """访问共享内存期间持有，产出 False 表示已停止、不能再访问"""
+        with self._users_cond:
+            entered = self.running
+            if entered:
+                self._users += 1
+        try:
+            yield entered
+        finally:
+            if entered:
+                with self._users_cond:
+                    self._users -= 1
+                    self._users_cond.notify_all()
+
+    def alive(self):
+        """正在运行且子进程没有意外退出"""
+        return self.running and self._process.is_alive()
+
+    def _report_dead(self):
+        if not self._dead_reported:
+            self._dead_reported = True
+            print(f'[Warning] 音频进程已退出 (exitcode={self._process.exitcode})，丢弃播放数据')
+
+    def read(self, timeout=None):
+        """取出下一帧，超时或已停止时返回 None。调用时释放上一次返回的帧"""
+        with self._access() as ok:
+            if not ok:
+                return None
+            if self._held:
+                self._capture.advance(self.record_bytes)
+                self._held = False
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._capture.used() < self.record_bytes:
+                if not self.alive() or (deadline is not None and time.monotonic() >= deadline):
+                    return None
+                time.sleep(POLL_INTERVAL)
+            header, data = self._capture.peek(self.record_bytes, split=TIMESTAMP_BYTES)
+            timestamp = struct.unpack_from('d', header)[0]
+            self._held = True
+            self._seq += 1
+            return CapturedFrame(data, timestamp, self._seq - 1)
+
+    def output_stream(self):
+        return PlaybackProxy(self, self.output_rate, self.max_buffer_ms)
+
+    def stats(self):
+        """子进程中的采集/播放统计 (含播放欠载 underruns)，直接读取共享内存中的计数"""
+        with self._access() as ok:
+            if not ok:
+                return dict(self._last_stats)
+            return self._status.counters()
+
+    def stop(self):
+        with self._users_cond:
+            if not self.running:
+                return
+            self._last_stats = self._status.counters()
+            self.running = False
+            # 等待仍在读写共享内存的线程 (例如阻塞在 write() 中的 TTS 线程) 退出
+            released = self._users_cond.wait_for(lambda: self._users == 0, STOP_TIMEOUT)
+        try:
+            self._conn.send(('stop', None))
+        except OSError:
+            pass  # 子进程已退出
+        self._process.join(timeout=3)
+        if self._process.is_alive():
+            self._process.terminate()
+        if released:
+            self._close_rings()
+        else:
+            # 不在其他线程访问时关闭映射；未删除的共享内存由 resource_tracker 在退出时清理
+            print('[Warning] 仍有线程在访问音频缓冲区，暂不关闭共享内存')
+        print('[Audio] 音频进程已停止')
+
+    def _close_rings(self):
+        for block in (self._capture, self._playback, self._status):
+            if block:
+                block.close()
+        self._capture = None
+        self._playback = None
+        self._status = None
+
+
+# ======= 卡顿对比 =======
+def _gil_load(stop_event):
+    """模拟 SDK 事件解析与 base64 处理的 GIL 压力"""
+    event = json.dumps({'type': 'response.audio.delta',
+                        'delta': base64.b64encode(bytes(48000)).decode('ascii')})
+    while not stop_event.is_set():
+        base64.b64decode(json.loads(event)['delta'])
+
+
+def _tone(rate, seconds, freq=440.0):
+    t = np.arange(int(rate * seconds)) / rate
+    return (3000 * np.sin(2 * np.pi * freq * t)).astype(np.int16).tobytes()
+
+
+def run_glitch_trial(mode, seconds, load_threads, rate=16000, chunk=3200, output_rate=24000):
+    """在 GIL 压力下播放音调并持续采集，返回卡顿统计"""
+    from audio_devices import get_manager
+    from capture import CaptureEngine
+
+    if mode == 'process':
+        engine = AudioProcess(rate=rate, chunk=chunk, output_rate=output_rate)
+        engine.start()
+        output = engine.output_stream()
+    else:
+        manager = get_manager()
+        engine = CaptureEngine(manager.pa, rate=rate, chunk=chunk)
+        engine.start()
+        output = manager.output_stream(None, output_rate)
+
+    stop_event = threading.Event()
+    tone = _tone(output_rate, 0.1)
+
+    def play():
+        output.mark_active(True)
+        while not stop_event.is_set():
+            output.write(tone)
+        output.mark_active(False)
+
+    def consume():
+        while not stop_event.is_set():
+            engine.read(timeout=0.2)
+
+    threads = [threading.Thread(target=play), threading.Thread(target=consume)]
+    threads += [threading.Thread(target=_gil_load, args=(stop_event,)) for _ in range(load_threads)]
+    for t in threads:
+        t.start()
+    time.sleep(seconds)
+    stop_event.set()
+    for t in threads:
+        t.join()
+
+    stats = engine.stats()
+    if mode != 'process':
+        stats['underruns'] = get_manager().underruns()
+    engine.stop()
+    if mode != 'process':
+        get_manager().shutdown()
+    return stats
+
+
+if __name__ == '__main__':
+    multiprocessing.freeze_support()
+    parser = argparse.ArgumentParser(description='单进程/独立音频进程卡顿对比')
+    parser.add_argument('--seconds', type=float, default=20.0)
+    parser.add_argument('--load-threads', type=int, default=4)
+    args = parser.parse_args()
+
+    for mode in ('single', 'process'):
+        result = run_glitch_trial(mode, args.seconds, args.load_threads)
+        print(f'[Glitch] mode={mode}, seconds={args.seconds}, load_threads={args.load_threads}, {result}')
@@ -0,0 +1,303 @@
+# coding=utf-8
+"""
+逐块热路径的微基准，离线运行 (合成 PCM + SDK 回调对象，不连接服务、不打开音频设备)。
+
+覆盖:
+- asr_send_chunk:     ASRClient.send_chunk 的 base64 编码 (6400 字节 = 0.2s@16kHz)
+- asr_dispatch:       asr.MyCallback.on_event 经 handlers 分发识别事件
+- tts_on_event:       qwen3tts.MyCallback.on_event 的 base64 解码、wave.writeframes 与播放写入
+- tts_on_event_catchup: 同上，开启追赶播放控制器 (未触发伸缩)
+- queue_handoff:      主循环中识别文本经 tts_queue 交给 TTS 线程
+- capture_handoff:    CaptureEngine 回调写入环形缓冲区并由主循环读出
+
+每项输出:
+- ns_per_chunk: 各项交替计时 ROUNDS 轮，取各轮的中位数；
+- peak_bytes:   处理一块时 tracemalloc 记录的内存峰值增量，单位是字节。它衡量临时分配的大小，
+                不是分配次数，标准库没有按次数统计分配的接口；
+- net_blocks:   每块净增的内存块数，非 0 说明有对象在累积。
+
+回退判定: peak_bytes 增加超过 PEAK_REGRESSION、net_blocks 增加超过 0.5 即为回退；计时受机器负载
+影响，同一代码重复运行的波动可达 ±40%，ns_per_chunk 变慢超过 TIME_REGRESSION 只打印警告，
+超过 TIME_NOISE_FLOOR 才算回退。
+
+基线与机器相关，不随代码提交，需在发布机器上先用 --save 生成。
+
+用法:
+    python bench_hotpaths.py               # 运行并与基线比较，有回退时退出码为 1，缺少基线时为 2
+    python bench_hotpaths.py --save        # 运行并保存为新的基线
+"""
+import argparse
+import base64
+import contextlib
+import gc
+import json
+import os
+import platform
+import queue
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pyaudio
+
+import asr
+import qwen3tts
+from capture import CaptureEngine
+from tsm import CatchUpController
+
+BASELINE_PATH = 'bench_baseline.json'
+ASR_CHUNK_FRAMES = 3200          # 与 main.py 的 CHUNK 一致
+TTS_DELTA_BYTES = 4800           # 0.1s@24kHz
+TIME_REGRESSION = 0.20           # ns/chunk 变慢超过 20% 时警告
+TIME_NOISE_FLOOR = 0.50          # ns/chunk 变慢超过 50% 才视为回退 (同一代码重复运行的波动可达 ±40%)
+PEAK_REGRESSION = 0.10           # peak_bytes 增加超过 10% 视为回退
+ROUNDS = 9                       # 计时轮数，取各轮的中位数
+
+
+def synthetic_pcm(nbytes, seed=0):
+    """带噪声的正弦波 16bit PCM"""
+    n = nbytes // 2
+    t = np.arange(n)
+    rng = np.random.default_rng(seed)
+    wave_ = 4000 * np.sin(2 * np.pi * 220 * t / 16000) + rng.normal(0, 300, n)
+    return wave_.astype(np.int16).tobytes()
+
+
+class _NullConversation:
+    def append_audio(self, audio_b64):
+        pass
+
+
+class _NullStream:
+    def write(self, data):
+        pass
+
+    def flush(self):
+        pass
+
+    def mark_active(self, active):
+        pass
+
+    def get_output_latency(self):
+        return 0.0
+
+
+def measure_times(cases, iterations):
+    """
+    各项交替分轮计时，返回 {name: [每轮的 ns/chunk]}。
+    每轮依次跑完所有项，机器负载、频率的变化会同时落到每一项上，而不是集中在某一项
+    """
+    per_round = max(iterations // ROUNDS, 1)
+    for _, step in cases:
+        for _ in range(min(iterations // 10, 1000)):
+            step()
+    samples = {name: [] for name, _ in cases}
+    gc.collect()
+    gc.disable()
+    try:
+        for _ in range(ROUNDS):
+            for name, step in cases:
+                t0 = time.perf_counter_ns()
+                for _ in range(per_round):
+                    step()
+                samples[name].append((time.perf_counter_ns() - t0) / per_round)
+    finally:
+        gc.enable()
+    return samples
+
+
+def measure_alloc(step, alloc_iterations=200):
+    """返回 (peak_bytes/chunk, net_blocks/chunk)"""
+    gc.collect()
+    gc.disable()
+    try:
+        blocks0 = sys.getallocatedblocks()
+        for _ in range(alloc_iterations):
+            step()
+        net_blocks = (sys.getallocatedblocks() - blocks0) / alloc_iterations
+    finally:
+        gc.enable()
+
+    tracemalloc.start()
+    peak_total = 0
+    for _ in range(alloc_iterations):
+        current, _ = tracemalloc.get_traced_memory()
+        tracemalloc.reset_peak()
+        step()
+        _, peak = tracemalloc.get_traced_memory()
+        peak_total += peak - current
+    tracemalloc.stop()
+    return peak_total / alloc_iterations, net_blocks
+
+
+def bench_asr_send_chunk():
+    client = asr.ASRClient.__new__(asr.ASRClient)
+    client.conversation = _NullConversation()
+    chunk = synthetic_pcm(ASR_CHUNK_FRAMES * 2)
+    return lambda: client.send_chunk(chunk)
+
+
+def bench_asr_dispatch():
+    callback = asr.MyCallback(conversation=None)
+    events = [
+        {'type': 'conversation.item.input_audio_transcription.text', 'stash': '今天天气'},
+        {'type': 'conversation.item.input_audio_transcription.completed', 'transcript': '今天天气不错'},
+        {'type': 'input_audio_buffer.speech_started'},
+        {'type': 'response.audio_transcript.delta'},  # 无对应 handler
+    ]
+    state = {'i': 0}
+
+    def step():
+        callback.on_event(events[state['i'] & 3])
+        state['i'] += 1
+        if len(callback.results) > 1000:
+            callback.results.clear()
+    return step
+
+
+def _tts_callback(wav, catchup):
+    callback = qwen3tts.MyCallback(catchup=catchup, output_stream=_NullStream(), wav=wav)
+    callback.begin_utterance(time.perf_counter())
+    event = {'type': 'response.audio.delta',
+             'delta': base64.b64encode(synthetic_pcm(TTS_DELTA_BYTES, seed=1)).decode('ascii')}
+
+    def step():
+        # 每个块都视为落后 0 秒，避免触发时间伸缩
+        callback.utterance_origin = time.perf_counter() - callback.consumed
+        callback.on_event(event)
+    return step, callback
+
+
+def bench_queue_handoff():
+    q = queue.Queue()
+
+    def step():
+        q.put(('今天天气不错', time.perf_counter()))
+        text, enqueued_at = q.get_nowait()
+        q.task_done()
+    return step
+
+
+def bench_capture_handoff(p):
+    engine = CaptureEngine(p, chunk=ASR_CHUNK_FRAMES)
+    chunk = synthetic_pcm(ASR_CHUNK_FRAMES * 2)
+    time_info = {'input_buffer_adc_time': 0.0, 'current_time': 0.0}
+
+    def step():
+        engine._callback(chunk, ASR_CHUNK_FRAMES, time_info, 0)
+        frame = engine.read(timeout=0)
+        return frame.data
+    return step
+
+
+def run_all(iterations):
+    results = {}
+    devnull = open(os.devnull, 'w', encoding='utf-8')
+    tmpdir = tempfile.mkdtemp(prefix='bench_')
+    p = pyaudio.PyAudio()
+    callbacks = []
+    wav = None
+    try:
+        # 回调中的 print 输出到空设备，只测分发本身
+        with contextlib.redirect_stdout(devnull):
+            # 与 TTSClient 一样，各回调共用一个 WAV 文件
+            wav = qwen3tts.WavWriter(os.path.join(tmpdir, 'bench_output.wav'))
+            tts_step, tts_cb = _tts_callback(wav, catchup=None)
+            catchup_step, catchup_cb = _tts_callback(wav, catchup=CatchUpController())
+            callbacks = [tts_cb, catchup_cb]
+            cases = [
+                ('asr_send_chunk', bench_asr_send_chunk()),
+                ('asr_dispatch', bench_asr_dispatch()),
+                ('tts_on_event', tts_step),
+                ('tts_on_event_catchup', catchup_step),
+                ('queue_handoff', bench_queue_handoff()),
+                ('capture_handoff', bench_capture_handoff(p)),
+            ]
+            samples = measure_times(cases, iterations)
+            for name, step in cases:
+                peak_bytes, net_blocks = measure_alloc(step)
+                results[name] = {'ns_per_chunk': round(statistics.median(samples[name]), 1),
+                                 'peak_bytes': round(peak_bytes, 1),
+                                 'net_blocks': round(net_blocks, 3)}
+    finally:
+        with contextlib.redirect_stdout(devnull):
+            for cb in callbacks:
+                cb.close()
+            if wav:
+                wav.close()
+        p.terminate()
+        devnull.close()
+        shutil.rmtree(tmpdir, ignore_errors=True)
+    return results
+
+
+def compare(results, baseline):
+    """
+    返回 (回退项列表, 警告列表)。基线中缺少的项也计入回退，避免新增的项永远不被检查。
+    peak_bytes、net_blocks 是确定性的，超出即回退；ns_per_chunk 超过 TIME_REGRESSION 只警告，
+    超过 TIME_NOISE_FLOOR 才算回退
+    """
+    regressions, warnings = [], []
+    for name, cur in results.items():
+        base = baseline.get(name)
+        if not base or 'peak_bytes' not in base:
+            regressions.append(f'{name}: 基线中没有该项，请用 --save 更新基线')
+            continue
+        ns_change = f"{name}: ns_per_chunk {base['ns_per_chunk']} -> {cur['ns_per_chunk']}"
+        if cur['ns_per_chunk'] > base['ns_per_chunk'] * (1 + TIME_NOISE_FLOOR):
+            regressions.append(ns_change)
+        elif cur['ns_per_chunk'] > base['ns_per_chunk'] * (1 + TIME_REGRESSION):
+            warnings.append(ns_change)
+        if cur['peak_bytes'] > base['peak_bytes'] * (1 + PEAK_REGRESSION) + 64:
+            regressions.append(f"{name}: peak_bytes {base['peak_bytes']} -> {cur['peak_bytes']}")
+        if cur['net_blocks'] > base['net_blocks'] + 0.5:
+            regressions.append(f"{name}: net_blocks {base['net_blocks']} -> {cur['net_blocks']}")
+    return regressions, warnings
+
+
+def main():
+    parser = argparse.ArgumentParser(description='逐块热路径微基准')
+    parser.add_argument('--iterations', type=int, default=20000)
+    parser.add_argument('--save', action='store_true', help='保存结果为新的基线')
+    parser.add_argument('--baseline', default=BASELINE_PATH)
+    args = parser.parse_args()
+
+    results = run_all(args.iterations)
+    baseline = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, 'r', encoding='utf-8') as f:
+            baseline = json.load(f).get('results', {})
+
+    print(f'{"case":<22} {"ns/chunk":>12} {"peak_bytes":>12} {"net_blocks":>11} {"vs baseline":>12}')
+    for name, r in results.items():
+        base = baseline.get(name)
+        delta = f"{(r['ns_per_chunk'] / base['ns_per_chunk'] - 1) * 100:+.1f}%" if base else '-'
+        print(f"{name:<22} {r['ns_per_chunk']:>12.1f} {r['peak_bytes']:>12.1f} "
+              f"{r['net_blocks']:>11.3f} {delta:>12}")
+
+    if args.save:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump({'python': platform.python_version(), 'machine': platform.machine(),
+                       'iterations': args.iterations, 'results': results}, f, indent=4)
+        print(f'基线已保存至: {args.baseline}')
+        return 0
+
+    if not baseline:
+        # 没有基线时无法判断回退，不能当作通过
+        print(f'[Warning] 未找到基线 {args.baseline}，请先在发布机器上运行 --save 生成')
+        return 2
+
+    regressions, warnings = compare(results, baseline)
+    for w in warnings:
+        print(f'[Warning] {w} (未超过噪声阈值 {TIME_NOISE_FLOOR:.0%}，不计为回退)')
+    for r in regressions:
+        print(f'[Regression] {r}')
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
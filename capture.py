@@ -0,0 +1,144 @@
+# coding=utf-8
+"""
+回调模式的麦克风采集引擎。
+
+PyAudio 在其回调线程中把每块音频写入预分配的环形缓冲区，消费者通过 read()
+以 memoryview 的形式拿到帧数据，不做额外拷贝。同时统计:
+- input_overflows: 驱动报告的输入溢出 (paInputOverflow)
+- overruns: 消费者来不及读取、环形缓冲区已满而丢弃的帧
+- gaps: 相邻两帧的采集时间间隔明显大于一帧时长的次数
+"""
+import threading
+import time
+
+import pyaudio
+
+
+class CapturedFrame:
+    """一帧采集数据。data 在下一次调用 CaptureEngine.read() 之前有效"""
+    __slots__ = ('data', 'timestamp', 'seq')
+
+    def __init__(self, data, timestamp, seq):
+        self.data = data            # memoryview，指向环形缓冲区
+        self.timestamp = timestamp  # 该帧第一个样本的采集时间 (time.time())
+        self.seq = seq              # 帧序号 (含丢弃的帧)
+
+
+class CaptureEngine:
+    def __init__(self, p, rate=16000, chunk=3200, channels=1, fmt=pyaudio.paInt16,
+                 input_device_index=None, slots=32):
+        self.p = p
+        self.rate = rate
+        self.chunk = chunk
+        self.channels = channels
+        self.format = fmt
+        self.input_device_index = input_device_index
+        self.slots = slots
+        self.frame_bytes = chunk * channels * p.get_sample_size(fmt)
+        self.frame_duration = chunk / rate
+
+        # 预分配环形缓冲区
+        self._buf = bytearray(self.frame_bytes * slots)
+        self._view = memoryview(self._buf)
+        self._timestamps = [0.0] * slots
+        self._seqs = [0] * slots
+        self._write = 0  # 已写入的帧数
+        self._read = 0   # 已释放的帧数
+        self._held = False
+        self._cond = threading.Condition()
+        self._stream = None
+        self._running = False
+        self._last_timestamp = None
+        self._seq = 0
+
+        self.input_overflows = 0
+        self.overruns = 0
+        self.gaps = 0
+
+    def start(self):
+        if self._stream:
+            return
+        self._running = True
+        self._last_timestamp = None
+        self._stream = self.p.open(format=self.format,
+                                   channels=self.channels,
+                                   rate=self.rate,
+                                   input=True,
+                                   input_device_index=self.input_device_index,
+                                   frames_per_buffer=self.chunk,
+                                   stream_callback=self._callback)
+        self._stream.start_stream()
+
+    def stop(self):
+        with self._cond:
+            self._running = False
+            self._cond.notify_all()
+        if self._stream:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+
+    def _callback(self, in_data, frame_count, time_info, status):
+        now = time.time()
+        if status & pyaudio.paInputOverflow:
+            self.input_overflows += 1
+
+        # 用 PortAudio 的流时间把回调时刻换算为该帧的采集时刻
+        adc_time = time_info.get('input_buffer_adc_time', 0)
+        current_time = time_info.get('current_time', 0)
+        timestamp = now - (current_time - adc_time) if adc_time and current_time else now
+        if self._last_timestamp is not None and \
+                timestamp - self._last_timestamp > self.frame_duration * 1.5:
+            self.gaps += 1
+        self._last_timestamp = timestamp
+
+        seq = self._seq
+        self._seq += 1
+        with self._cond:
+            if self._write - self._read >= self.slots:
+                # 消费者落后，丢弃最新一帧
+                self.overruns += 1
+                return (None, pyaudio.paContinue)
+            slot = self._write % self.slots
+            offset = slot * self.frame_bytes
+            n = min(len(in_data), self.frame_bytes)
+            self._view[offset:offset + n] = memoryview(in_data)[:n]
+            if n < self.frame_bytes:
+                self._view[offset + n:offset + self.frame_bytes] = bytes(self.frame_bytes - n)
+            self._timestamps[slot] = timestamp
+            self._seqs[slot] = seq
+            self._write += 1
+            self._cond.notify()
+        return (None, pyaudio.paContinue)
+
+    def read(self, timeout=None):
+        """
+        取出下一帧，超时或已停止时返回 None。
+        调用时会释放上一次返回的帧，其 data 随后可能被覆盖
+        """
+        with self._cond:
+            if self._held:
+                self._read += 1
+                self._held = False
+            if not self._cond.wait_for(lambda: self._write > self._read or not self._running, timeout):
+                return None
+            if self._write == self._read:
+                return None
+            slot = self._read % self.slots
+            offset = slot * self.frame_bytes
+            self._held = True
+            return CapturedFrame(self._view[offset:offset + self.frame_bytes],
+                                 self._timestamps[slot], self._seqs[slot])
+
+    def backlog(self):
+        """尚未读取的帧数"""
+        with self._cond:
+            return self._write - self._read - (1 if self._held else 0)
+
+    def stats(self):
+        return {
+            'frames': self._seq,
+            'input_overflows': self.input_overflows,
+            'overruns': self.overruns,
+            'gaps': self.gaps,
+        }
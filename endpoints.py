@@ -0,0 +1,258 @@
+# coding=utf-8
+"""
+DashScope 地域选择。
+
+启动时对候选地域测量 TCP+TLS 建连耗时和一次 HTTPS 往返耗时，选出 API Key 可用且最快的地域，
+结果缓存到本地文件 (带 TTL)。TTS 连续多次首包延迟过高时在后台线程重新测速。
+
+音色只在注册它的地域可用，pin() 把选择固定在当前音色所在的地域: 重新测速时最快的地域
+若是其他地域，本次运行不切换 (TTS 与 ASR 始终连接同一地域)，只把它写入缓存，
+下次启动时选用该地域并在那里重新注册音色。
+
+候选地域可通过环境变量 DASHSCOPE_REGIONS (逗号分隔的地域名) 或 configure() 限定。
+"""
+import hashlib
+import json
+import os
+import socket
+import ssl
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlparse
+
+import requests
+
+# ======= 候选地域 =======
+# 新加坡地域和北京地域的API Key不同，Key 不匹配的地域会在测速时被排除
+REGIONS = [
+    {
+        'name': 'cn-beijing',
+        'ws_url': 'wss://dashscope.aliyuncs.com/api-ws/v1/realtime',
+        'http_base': 'https://dashscope.aliyuncs.com',
+    },
+    {
+        'name': 'ap-southeast-1',
+        'ws_url': 'wss://dashscope-intl.aliyuncs.com/api-ws/v1/realtime',
+        'http_base': 'https://dashscope-intl.aliyuncs.com',
+    },
+]
+CUSTOMIZATION_PATH = '/api/v1/services/audio/tts/customization'
+
+CACHE_PATH = 'endpoint_cache.json'
+CACHE_TTL = 24 * 3600       # 测速结果缓存时长 (秒)
+PROBE_TIMEOUT = 3.0         # 单个地域测速超时 (秒)
+SLOW_FIRST_AUDIO_MS = 1500  # 首包延迟超过该值视为慢
+SLOW_LIMIT = 3              # 连续慢多少次后重新测速
+
+
+def _api_key():
+    return os.environ.get('DASHSCOPE_API_KEY', '')
+
+
+def _key_fingerprint(api_key):
+    return hashlib.sha256(api_key.encode('utf-8')).hexdigest()[:12]
+
+
+def probe_region(region, api_key, timeout=PROBE_TIMEOUT):
+    """
+    测量单个地域: connect_ms 为 TCP+TLS 建连耗时，rtt_ms 为一次鉴权请求的往返耗时。
+    compatible 表示 API Key 在该地域可用
+    """
+    result = {'name': region['name'], 'connect_ms': None, 'rtt_ms': None,
+              'compatible': False, 'error': None}
+    host = urlparse(region['http_base']).hostname
+    try:
+        t0 = time.perf_counter()
+        with socket.create_connection((host, 443), timeout=timeout) as sock:
+            with ssl.create_default_context().wrap_socket(sock, server_hostname=host):
+                result['connect_ms'] = (time.perf_counter() - t0) * 1000
+
+        # 查询音色列表，既能测往返耗时也能校验 API Key 是否属于该地域
+        payload = {
+            "model": "qwen-voice-enrollment",
+            "input": {"action": "list", "page_size": 1, "page_index": 0}
+        }
+        headers = {"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"}
+        t0 = time.perf_counter()
+        resp = requests.post(region['http_base'] + CUSTOMIZATION_PATH, json=payload,
+                             headers=headers, timeout=timeout)
+        result['rtt_ms'] = (time.perf_counter() - t0) * 1000
+        result['compatible'] = resp.status_code not in (401, 403)
+        if not result['compatible']:
+            result['error'] = f'HTTP {resp.status_code}'
+    except Exception as e:
+        result['error'] = str(e)
+    return result
+
+
+class EndpointSelector:
+    def __init__(self, regions=None, cache_path=CACHE_PATH, ttl=CACHE_TTL):
+        self.regions = regions or REGIONS
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self._selected = None
+        self._selected_at = 0.0
+        self._key = None
+        self._slow_count = 0
+        self._pinned = None     # 当前音色所在的地域，选择固定为该地域
+        self._reprobing = False
+        self._lock = threading.Lock()
+
+    def select(self):
+        """返回当前选中的地域 (dict)，缓存过期或 API Key 变化时重新测速"""
+        with self._lock:
+            key = _key_fingerprint(_api_key())
+            if self._selected and self._key == key and time.time() - self._selected_at < self.ttl:
+                return self._selected
+            if not self._load_cache(key):
+                results = self._measure()
+                self._apply(key, self._choose(results), results)
+            return self._selected
+
+    def ws_url(self):
+        return self.select()['ws_url']
+
+    def customization_url(self):
+        return self.select()['http_base'] + CUSTOMIZATION_PATH
+
+    def region_name(self):
+        return self.select()['name']
+
+    def pin(self, region_name):
+        """固定使用 region_name (当前音色注册所在的地域)"""
+        region = next((r for r in self.regions if r['name'] == region_name), None)
+        if region is None:
+            print(f'[Warning] 音色所在的地域 {region_name} 不在候选地域中，无法固定')
+            return
+        with self._lock:
+            self._pinned = region_name
+            if self._selected and self._selected['name'] != region_name:
+                print(f'[Endpoint] 当前音色注册在 {region_name}，改用该地域')
+                self._selected = region
+
+    def invalidate(self):
+        with self._lock:
+            self._selected = None
+            self._slow_count = 0
+            try:
+                os.remove(self.cache_path)
+            except OSError:
+                pass
+
+    def record_first_audio_delay(self, delay_ms):
+        """
+        记录一次 TTS 首包延迟 (毫秒)。连续 SLOW_LIMIT 次过慢时在后台线程重新测速，
+        不阻塞调用线程 (播放线程)；返回 True 表示已开始重新测速
+        """
+        if delay_ms is None:
+            return False
+        if delay_ms < SLOW_FIRST_AUDIO_MS:
+            self._slow_count = 0
+            return False
+        self._slow_count += 1
+        if self._slow_count < SLOW_LIMIT or self._reprobing:
+            return False
+        print(f'[Endpoint] 连续 {self._slow_count} 次首包延迟超过 {SLOW_FIRST_AUDIO_MS}ms，重新测速')
+        self._slow_count = 0
+        self._reprobing = True
+        threading.Thread(target=self._reprobe, name='EndpointProbe', daemon=True).start()
+        return True
+
+    def _reprobe(self):
+        """测速期间继续使用原地域，测完后再替换选择"""
+        try:
+            key = _key_fingerprint(_api_key())
+            results = self._measure()
+            with self._lock:
+                self._apply(key, self._choose(results), results)
+        except Exception as e:
+            print(f'[Warning] 重新测速失败: {e}')
+        finally:
+            self._reprobing = False
+
+    def _measure(self):
+        api_key = _api_key()
+        with ThreadPoolExecutor(max_workers=len(self.regions)) as pool:
+            results = list(pool.map(lambda r: probe_region(r, api_key), self.regions))
+        for r in results:
+            connect = f"{r['connect_ms']:.0f}ms" if r['connect_ms'] is not None else '-'
+            rtt = f"{r['rtt_ms']:.0f}ms" if r['rtt_ms'] is not None else '-'
+            print(f"[Endpoint] {r['name']}: connect={connect}, rtt={rtt}, "
+                  f"compatible={r['compatible']}" + (f", error={r['error']}" if r['error'] else ''))
+        return results
+
+    def _choose(self, results):
+        candidates = [r for r in results if r['compatible'] and r['rtt_ms'] is not None]
+        if candidates:
+            best = min(candidates, key=lambda r: r['connect_ms'] + r['rtt_ms'])
+            region = next(reg for reg in self.regions if reg['name'] == best['name'])
+        else:
+            # 全部测速失败时退回第一个候选地域
+            region = self.regions[0]
+            print(f"[Endpoint] 没有可用的地域，使用默认地域 {region['name']}")
+        return region
+
+    def _apply(self, key, region, results):
+        """缓存测速选出的地域；固定了地域时本次运行仍使用固定的地域"""
+        current = region
+        if self._pinned and region['name'] != self._pinned:
+            print(f"[Endpoint] 最快的地域为 {region['name']}，但当前音色注册在 {self._pinned}，"
+                  f"本次运行不切换，下次启动时使用")
+            current = next(r for r in self.regions if r['name'] == self._pinned)
+        print(f"[Endpoint] 选择地域: {current['name']}")
+        self._selected = current
+        self._selected_at = time.time()
+        self._key = key
+        self._slow_count = 0
+        try:
+            with open(self.cache_path, 'w', encoding='utf-8') as f:
+                json.dump({'region': region['name'], 'selected_at': self._selected_at,
+                           'key': key, 'probes': results}, f, indent=4, ensure_ascii=False)
+        except Exception as e:
+            print(f'[Warning] 保存地域缓存失败: {e}')
+
+    def _load_cache(self, key):
+        if not os.path.exists(self.cache_path):
+            return False
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                cache = json.load(f)
+        except Exception as e:
+            print(f'[Warning] 读取地域缓存失败: {e}')
+            return False
+        if cache.get('key') != key or time.time() - cache.get('selected_at', 0) >= self.ttl:
+            return False
+        region = next((r for r in self.regions if r['name'] == cache.get('region')), None)
+        if not region or (self._pinned and region['name'] != self._pinned):
+            return False
+        self._selected = region
+        self._selected_at = cache['selected_at']
+        self._key = key
+        print(f"[Endpoint] 使用缓存的地域: {region['name']}")
+        return True
+
+
+_selector = None
+_selector_lock = threading.Lock()
+
+
+def configure(region_names=None, cache_path=CACHE_PATH, ttl=CACHE_TTL):
+    """限定候选地域 (按名称)，并替换全局选择器"""
+    global _selector
+    regions = [r for r in REGIONS if not region_names or r['name'] in region_names]
+    if not regions:
+        raise ValueError(f'未知的地域: {region_names}')
+    with _selector_lock:
+        _selector = EndpointSelector(regions, cache_path=cache_path, ttl=ttl)
+    return _selector
+
+
+def get_selector():
+    global _selector
+    with _selector_lock:
+        if _selector is None:
+            names = [n.strip() for n in os.environ.get('DASHSCOPE_REGIONS', '').split(',') if n.strip()]
+            regions = [r for r in REGIONS if not names or r['name'] in names] or REGIONS
+            _selector = EndpointSelector(regions)
+        return _selector
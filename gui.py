@@ -6,11 +6,17 @@ import queue
 import sys
 import time
 import re
+import multiprocessing
 from asr import ASRClient
-from qwen3tts import TTSClient, create_voice
+from qwen3tts import TTSClient, create_voice, TTS_SAMPLE_RATE, DEFAULT_POOL_SIZE
+from capture import CaptureEngine
+from audio_devices import get_manager
+from audio_process import AudioProcess
+from profiler import SamplingProfiler, install_signal_toggle
 import os
 import dashscope
 import json
+import endpoints
 
 # Configuration
 CHUNK = 3200
@@ -35,10 +41,15 @@ class VoiceChangerGUI:
         self.root.title("实时变声器 (Qwen)")
         self.root.geometry("600x500")
 
-        self.p = pyaudio.PyAudio()
+        # 与 TTS 播放共用进程级的 PyAudio 实例
+        self.p = get_manager().pa
         self.is_running = False
         self.thread = None
         self.stop_event = threading.Event()
+        self.tts_client = None  # 运行中的 TTS 客户端，用于热切换音色
+
+        # 采样分析器，结果写入程序目录下的 profiles/
+        self.profiler = SamplingProfiler(output_dir=os.path.join(self.get_app_path(), 'profiles'))
 
         # Load Config
         self.config_file = os.path.join(self.get_app_path(), 'config.json')
@@ -49,6 +60,13 @@ class VoiceChangerGUI:
             os.environ['DASHSCOPE_API_KEY'] = self.config['api_key']
             dashscope.api_key = self.config['api_key']
 
+        # 限定候选地域，例如 "regions": ["cn-beijing"]
+        if self.config.get('regions'):
+            try:
+                endpoints.configure(self.config['regions'])
+            except ValueError as e:
+                print(f"地域配置无效: {e}")
+
         # API Key Configuration
         frame_api = ttk.LabelFrame(root, text="API Key 配置")
         frame_api.pack(fill="x", padx=10, pady=5)
@@ -101,6 +119,30 @@ class VoiceChangerGUI:
         self.btn_stop = ttk.Button(frame_ctrl, text="停止", command=self.stop_changing, state="disabled")
         self.btn_stop.pack(side="right", padx=20, expand=True)
 
+        # 打断：说话时立即停止正在播放的语音（建议佩戴耳机，避免回声误触发）。
+        # 默认关闭：连续说话时下一句总在上一句播放期间开始，开启后上一句会被截断
+        self.barge_in = False
+        self.barge_in_var = tk.BooleanVar(value=self.barge_in)
+        chk_barge_in = ttk.Checkbutton(frame_ctrl, text="允许打断", variable=self.barge_in_var,
+                                       command=self.toggle_barge_in)
+        chk_barge_in.pack(side="right", padx=20, expand=True)
+
+        # 播放时继续收音：连续说话时下一句在上一句播放期间就能识别，追赶播放和 TTS 连接池才有积压可处理。
+        # 使用扬声器时关闭，避免合成的声音被麦克风录入
+        self.listen_while_speaking = True
+        self.listen_var = tk.BooleanVar(value=self.listen_while_speaking)
+        chk_listen = ttk.Checkbutton(frame_ctrl, text="播放时收音", variable=self.listen_var,
+                                     command=self.toggle_listen)
+        chk_listen.pack(side="right", padx=20, expand=True)
+
+        # 独立音频进程：采集和播放不受主进程 GIL 争用影响，下次开始时生效
+        self.audio_process_var = tk.BooleanVar(value=False)
+        chk_audio_process = ttk.Checkbutton(frame_ctrl, text="独立音频进程", variable=self.audio_process_var)
+        chk_audio_process.pack(side="right", padx=20, expand=True)
+
+        self.btn_profile = ttk.Button(frame_ctrl, text="开始性能采样", command=self.toggle_profiler)
+        self.btn_profile.pack(side="right", padx=20, expand=True)
+
         # Log Area
         frame_log = ttk.LabelFrame(root, text="日志")
         frame_log.pack(fill="both", expand=True, padx=10, pady=5)
@@ -192,8 +234,12 @@ class VoiceChangerGUI:
             print(f"正在为 {filename} 生成新音色...")
             try:
                 # Force refresh because user explicitly changed the file
-                create_voice(filename, force_refresh=True)
+                voice_id = create_voice(filename, force_refresh=True)
                 print(f"音色生成完毕。")
+                # 正在运行时直接热切换，无需重启会话
+                tts_client = self.tts_client
+                if tts_client:
+                    tts_client.set_voice(voice_id)
             except Exception as e:
                 print(f"音色生成失败: {e}")
             finally:
@@ -201,7 +247,23 @@ class VoiceChangerGUI:
                 if not self.is_running:
                      self.root.after(0, lambda: self.btn_start.config(state="normal"))
 
-        threading.Thread(target=task).start()
+        threading.Thread(target=task, daemon=True).start()
+
+    def toggle_barge_in(self):
+        # 工作线程只读取普通属性，避免跨线程访问 Tk 变量
+        self.barge_in = self.barge_in_var.get()
+        print(f"打断功能已{'开启' if self.barge_in else '关闭'}")
+
+    def toggle_listen(self):
+        self.listen_while_speaking = self.listen_var.get()
+        print(f"播放时收音已{'开启' if self.listen_while_speaking else '关闭'}")
+
+    def toggle_profiler(self):
+        self.profiler.toggle()
+        self.update_profiler_button()
+
+    def update_profiler_button(self):
+        self.btn_profile.config(text="停止性能采样" if self.profiler.running else "开始性能采样")
 
     def get_selected_input_index(self):
         idx = self.input_device_combo.current()
@@ -228,8 +290,10 @@ class VoiceChangerGUI:
         
         input_idx = self.get_selected_input_index()
         output_idx = self.get_selected_output_index()
+        use_audio_process = self.audio_process_var.get()
         
-        self.thread = threading.Thread(target=self.run_voice_loop, args=(voice_path, input_idx, output_idx))
+        self.thread = threading.Thread(target=self.run_voice_loop,
+                                       args=(voice_path, input_idx, output_idx, use_audio_process))
         self.thread.start()
 
     def stop_changing(self):
@@ -239,70 +303,91 @@ class VoiceChangerGUI:
         self.btn_stop.config(state="disabled")
         print("正在停止... 请等待资源释放。")
 
-    def run_voice_loop(self, voice_path, input_idx, output_idx):
+    def run_voice_loop(self, voice_path, input_idx, output_idx, use_audio_process=False):
         print(f"开始运行，使用声音文件：{voice_path}")
         print(f"输入设备索引：{input_idx}，输出设备索引：{output_idx}")
         
         tts_queue = queue.Queue()
         asr_client = None
         tts_client = None
-        stream = None
+        capture = None
+        tts_thread = None
         
         try:
+            # Init Audio I/O (callback mode, or a separate audio process)
+            output_stream = None
+            if use_audio_process:
+                capture = AudioProcess(rate=RATE, chunk=CHUNK, input_device_index=input_idx,
+                                       output_device_index=output_idx, output_rate=TTS_SAMPLE_RATE)
+                output_stream = capture.output_stream()
+            else:
+                capture = CaptureEngine(self.p, rate=RATE, chunk=CHUNK, channels=CHANNELS, fmt=FORMAT,
+                                        input_device_index=input_idx)
+            
             # Init Clients
             asr_client = ASRClient()
             asr_client.connect()
             
             def on_text(text):
                 if text:
-                    tts_queue.put(text)
+                    tts_queue.put((text, time.perf_counter()))
             
             asr_client.set_callback(on_text)
             
             # Init TTS with custom voice and output device
-            tts_client = TTSClient(voice_file_path=voice_path, output_device_index=output_idx)
+            # config.json 中的 tts_pool_size 控制 TTS 连接数 (1 为不提前合成)，
+            # adaptive_rate 为 true 时链路较差时自动降低 TTS 采样率
+            tts_client = TTSClient(voice_file_path=voice_path, output_device_index=output_idx,
+                                   output_stream=output_stream,
+                                   pool_size=self.config.get('tts_pool_size', DEFAULT_POOL_SIZE),
+                                   adaptive_rate=self.config.get('adaptive_rate', False))
             tts_client.connect()
+            self.tts_client = tts_client
+            
+            # 检测到新语音时打断当前播放
+            def on_speech_start(started_at):
+                if self.barge_in:
+                    tts_client.cancel(started_at)
+            
+            asr_client.set_speech_start_callback(on_speech_start)
+            
+            # TTS 在独立线程中运行，播放期间麦克风持续采集
+            def tts_worker():
+                while self.is_running and not self.stop_event.is_set():
+                    try:
+                        text_to_speak, enqueued_at = tts_queue.get(timeout=0.2)
+                    except queue.Empty:
+                        continue
+                    print(f"\n[TTS] 正在播放：{text_to_speak}")
+                    try:
+                        tts_client.synthesize(text_to_speak, enqueued_at=enqueued_at)
+                    except Exception as e:
+                        print(f"TTS 错误：{e}")
+                    finally:
+                        tts_queue.task_done()
+                    print("正在监听...")
             
-            # Init Mic Stream
-            stream = self.p.open(format=FORMAT,
-                                 channels=CHANNELS,
-                                 rate=RATE,
-                                 input=True,
-                                 input_device_index=input_idx,
-                                 frames_per_buffer=CHUNK)
+            tts_thread = threading.Thread(target=tts_worker, daemon=True)
+            tts_thread.start()
+            
+            capture.start()
             
             asr_client.start_stream()
             print("正在监听...")
             
             while self.is_running and not self.stop_event.is_set():
                 # 1. Read Audio
-                try:
-                    data = stream.read(CHUNK, exception_on_overflow=False)
-                except IOError as e:
-                    print(f"读取错误：{e}")
+                frame = capture.read(timeout=0.5)
+                if frame is None:
                     continue
                 
-                # 2. Check TTS
-                try:
-                    text_to_speak = tts_queue.get_nowait()
-                    print(f"\n[TTS] 正在播放：{text_to_speak}")
-                    
-                    stream.stop_stream()
-                    try:
-                        tts_client.synthesize(text_to_speak)
-                    except Exception as e:
-                        print(f"TTS 错误：{e}")
-                    
-                    print("正在监听...")
-                    stream.start_stream()
-                    tts_queue.task_done()
+                # 2. 打断和播放时收音都未开启时，播放期间丢弃麦克风音频（避免回声）
+                if not (self.barge_in or self.listen_while_speaking) and tts_client.speaking:
                     continue
-                except queue.Empty:
-                    pass
                 
                 # 3. Send to ASR
                 try:
-                    asr_client.send_chunk(data)
+                    asr_client.send_chunk(frame.data)
                 except Exception as e:
                     print(f"ASR 发送错误：{e}")
         
@@ -310,9 +395,17 @@ class VoiceChangerGUI:
             print(f"循环错误：{e}")
         finally:
             print("正在清理资源...")
-            if stream:
-                stream.stop_stream()
-                stream.close()
+            self.tts_client = None
+            if tts_client:
+                tts_client.cancel()
+            if tts_thread:
+                tts_thread.join(timeout=2)
+            if capture:
+                glitches = capture.stats()
+                capture.stop()
+                if not use_audio_process:
+                    glitches["underruns"] = get_manager().underruns()
+                print(f"[采集统计] mode={'process' if use_audio_process else 'single'}, {glitches}")
             if asr_client:
                 asr_client.stop_stream()
                 asr_client.close()
@@ -321,6 +414,9 @@ class VoiceChangerGUI:
             print("已停止。")
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     root = tk.Tk()
     app = VoiceChangerGUI(root)
+    # 信号触发的启停在后台线程执行，按钮文字交回 Tk 主线程更新
+    install_signal_toggle(app.profiler, on_toggle=lambda running: root.after(0, app.update_profiler_button))
     root.mainloop()
@@ -1,22 +1,70 @@
 import pyaudio
 import os
+import argparse
 import time
 import queue
+import threading
+import multiprocessing
 from asr import ASRClient
-from qwen3tts import TTSClient
+from qwen3tts import TTSClient, TTS_SAMPLE_RATE, DEFAULT_POOL_SIZE
+from capture import CaptureEngine
+from audio_devices import get_manager
+from audio_process import AudioProcess
+from profiler import SamplingProfiler, install_signal_toggle, DEFAULT_INTERVAL
 
 # Configuration
 CHUNK = 3200  # chunk size for streaming (0.2s for 16k)
 FORMAT = pyaudio.paInt16
 CHANNELS = 1
 RATE = 16000
+LAG_TRACE_PATH = None  # Set to "lag_trace.csv" to save the catch-up lag trace on exit
+# New speech interrupts playback and drops the pipelined sentences (use headphones to avoid echo
+# triggering it). Off by default: a continuous speaker starts the next sentence while the previous
+# one is still playing, which would cut it off every time and defeat catch-up and the TTS pool.
+BARGE_IN = False
+# Keep sending mic audio to ASR while TTS plays, so the next sentence is recognized during playback
+# and catch-up / the TTS pool have a backlog to work on. Set to False when playing through
+# loudspeakers to keep the synthesized voice out of the mic (ignored when BARGE_IN is on).
+LISTEN_WHILE_SPEAKING = True
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Qwen realtime voice changer")
+    parser.add_argument("--profile", action="store_true",
+                        help="start the sampling profiler at launch (results are written on exit)")
+    parser.add_argument("--profile-interval", type=float, default=DEFAULT_INTERVAL,
+                        help="sampling interval in seconds")
+    parser.add_argument("--audio-process", action="store_true",
+                        help="run mic capture and playback in a separate process (shared-memory ring buffers)")
+    parser.add_argument("--tts-pool", type=int, default=DEFAULT_POOL_SIZE,
+                        help="number of TTS connections; the next utterance is synthesized while the current one plays")
+    parser.add_argument("--adaptive-rate", action="store_true",
+                        help="lower the TTS sample rate on slow links (switches at utterance boundaries)")
+    return parser.parse_args()
 
 def main():
+    args = parse_args()
+
+    # Sampling profiler: --profile starts it now, the signal toggles it at any time
+    profiler = SamplingProfiler(interval=args.profile_interval)
+    sig = install_signal_toggle(profiler)
+    if args.profile:
+        profiler.start()
+
     print("=== Voice Assistant Demo (Streaming) ===")
     print("Initializing clients...")
     
+    # Audio I/O: in-process callbacks, or a separate process isolated from the GIL
+    if args.audio_process:
+        capture = AudioProcess(rate=RATE, chunk=CHUNK, output_rate=TTS_SAMPLE_RATE)
+        output_stream = capture.output_stream()
+    else:
+        # One shared PyAudio instance for capture and TTS playback
+        capture = CaptureEngine(get_manager().pa, rate=RATE, chunk=CHUNK, channels=CHANNELS, fmt=FORMAT)
+        output_stream = None
+
     # Message queue for TTS
     tts_queue = queue.Queue()
+    stop_event = threading.Event()
 
     try:
         asr_client = ASRClient()
@@ -25,71 +73,69 @@ def main():
         # Callback to handle recognized text
         def on_text(text):
             if text:
-                tts_queue.put(text)
+                tts_queue.put((text, time.perf_counter()))
         
         asr_client.set_callback(on_text)
         
-        tts_client = TTSClient()
+        tts_client = TTSClient(catchup_trace_path=LAG_TRACE_PATH, output_stream=output_stream,
+                               pool_size=args.tts_pool, adaptive_rate=args.adaptive_rate)
         tts_client.connect()
+
+        # Barge-in: cancel the current utterance as soon as new speech starts
+        def on_speech_start(started_at):
+            if BARGE_IN:
+                tts_client.cancel(started_at)
+
+        asr_client.set_speech_start_callback(on_speech_start)
     except Exception as e:
         print(f"Initialization failed: {e}")
+        profiler.stop()
         return
 
+    # TTS runs on its own thread so the mic keeps streaming while speaking
+    def tts_worker():
+        while not stop_event.is_set():
+            try:
+                text_to_speak, enqueued_at = tts_queue.get(timeout=0.2)
+            except queue.Empty:
+                continue
+
+            print(f"\n[TTS] Speaking: {text_to_speak}")
+            try:
+                tts_client.synthesize(text_to_speak, enqueued_at=enqueued_at)
+            except Exception as e:
+                print(f"TTS Error: {e}")
+            finally:
+                tts_queue.task_done()
+            print("Listening...")
+
+    tts_thread = threading.Thread(target=tts_worker, daemon=True)
+    tts_thread.start()
+
     print("Initialization complete. Press Ctrl+C to stop.")
+    if sig is not None:
+        print(f"Send signal {sig.name} to this process (pid {os.getpid()}) to toggle the profiler.")
     print("Listening...")
 
-    p = pyaudio.PyAudio()
-    stream = p.open(format=FORMAT,
-                    channels=CHANNELS,
-                    rate=RATE,
-                    input=True,
-                    frames_per_buffer=CHUNK)
+    capture.start()
 
     # Start ASR Streaming
     asr_client.start_stream()
     
     try:
         while True:
-            # 1. Read Audio Chunk
-            try:
-                # Read without blocking too long if possible, but PyAudio blocks for chunk duration
-                data = stream.read(CHUNK, exception_on_overflow=False)
-            except IOError as e:
-                print(f"Audio read error: {e}")
+            # 1. Read Audio Chunk (filled by the PyAudio callback, no copy)
+            frame = capture.read(timeout=0.5)
+            if frame is None:
                 continue
 
-            # 2. Check for TTS task
-            try:
-                # Non-blocking check
-                text_to_speak = tts_queue.get_nowait()
-                
-                print(f"\n[TTS] Speaking: {text_to_speak}")
-                
-                # Pause recording/sending while speaking (to avoid echo)
-                # Ideally stop stream to clear buffer
-                stream.stop_stream()
-                
-                try:
-                    tts_client.synthesize(text_to_speak)
-                except Exception as e:
-                    print(f"TTS Error: {e}")
-                
-                # Resume recording
-                print("Listening...")
-                stream.start_stream()
-                
-                # Clear queue done
-                tts_queue.task_done()
-                
-                # Skip sending the current chunk as it might be old or noise
+            # 2. Unless listening during playback, drop mic audio while speaking (to avoid echo)
+            if not (BARGE_IN or LISTEN_WHILE_SPEAKING) and tts_client.speaking:
                 continue
-                
-            except queue.Empty:
-                pass
 
             # 3. Send Chunk to ASR
             try:
-                asr_client.send_chunk(data)
+                asr_client.send_chunk(frame.data)
             except Exception as e:
                 print(f"ASR Send Error: {e}")
                 # Try to reconnect?
@@ -99,13 +145,21 @@ def main():
         print("\nStopping...")
     finally:
         print("Cleaning up...")
-        stream.stop_stream()
-        stream.close()
-        p.terminate()
+        stop_event.set()
+        tts_client.cancel()
+        tts_thread.join(timeout=2)
+        glitches = capture.stats()
+        capture.stop()
+        if not args.audio_process:
+            glitches["underruns"] = get_manager().underruns()
+        print(f"[Glitch] mode={'process' if args.audio_process else 'single'}, {glitches}")
         
         asr_client.stop_stream()
         asr_client.close()
         tts_client.close()
+        get_manager().shutdown()
+        profiler.stop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()
     main()
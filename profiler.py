@@ -0,0 +1,242 @@
+# coding=utf-8
+"""
+低开销的全线程采样分析器。
+
+后台线程按固定间隔读取 sys._current_frames()，统计各线程 (Tk 主循环、run_voice_loop、
+SDK websocket 回调线程等) 的调用栈，停止时在 profiles/ 目录输出:
+- <prefix>.collapsed: 折叠栈格式 (线程名;栈底;...;栈顶 次数)，可直接交给 flamegraph.pl / speedscope
+- <prefix>.threads.txt: 各线程采样数与 CPU 时间，以及采样器自身的开销
+
+启停方式: main.py --profile、GUI 中的“性能采样”按钮，或发送信号
+(POSIX 为 SIGUSR1，Windows 为 Ctrl+Break)。
+
+直接运行本文件可测量开启采样后的开销:
+    python profiler.py
+"""
+import argparse
+import collections
+import os
+import signal
+import sys
+import threading
+import time
+
+DEFAULT_INTERVAL = 0.005  # 采样间隔 5ms (200Hz)
+DEFAULT_OUTPUT_DIR = 'profiles'
+MAX_DEPTH = 64
+
+
+def _thread_cpu_reader():
+    """返回 f(thread) -> 该线程累计 CPU 时间 (秒)；平台不支持时返回 None"""
+    if hasattr(time, 'pthread_getcpuclockid'):
+        def read(thread):
+            try:
+                return time.clock_gettime(time.pthread_getcpuclockid(thread.ident))
+            except (OSError, OverflowError, TypeError):
+                return None
+        return read
+
+    if sys.platform == 'win32':
+        import ctypes
+        from ctypes import wintypes
+        kernel32 = ctypes.WinDLL('kernel32', use_last_error=True)
+        THREAD_QUERY_LIMITED_INFORMATION = 0x0800
+
+        def read(thread):
+            handle = kernel32.OpenThread(THREAD_QUERY_LIMITED_INFORMATION, False, thread.native_id)
+            if not handle:
+                return None
+            try:
+                times = [wintypes.FILETIME() for _ in range(4)]
+                if not kernel32.GetThreadTimes(handle, *[ctypes.byref(t) for t in times]):
+                    return None
+                # kernel + user，单位 100ns
+                total = 0
+                for t in times[2:]:
+                    total += (t.dwHighDateTime << 32) | t.dwLowDateTime
+                return total / 1e7
+            finally:
+                kernel32.CloseHandle(handle)
+        return read
+
+    return lambda thread: None
+
+
+_read_thread_cpu = _thread_cpu_reader()
+
+
+class SamplingProfiler:
+    def __init__(self, interval=DEFAULT_INTERVAL, output_dir=DEFAULT_OUTPUT_DIR):
+        self.interval = interval
+        self.output_dir = output_dir
+        self._thread = None
+        self._stop_event = threading.Event()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None
+
+    def start(self):
+        with self._lock:
+            if self._thread:
+                return
+            self._stacks = collections.Counter()
+            self._samples = collections.Counter()
+            self._cpu_first = {}
+            self._cpu_last = {}
+            self._names = {}
+            self._sampler_cpu = 0.0
+            self._started_at = time.perf_counter()
+            self._stop_event.clear()
+            self._thread = threading.Thread(target=self._run, name='SamplingProfiler', daemon=True)
+            self._thread.start()
+        print(f'[Profiler] 采样已开启 (间隔 {self.interval * 1000:.1f}ms)')
+
+    def stop(self):
+        """停止采样并写出结果，返回 .collapsed 文件路径"""
+        with self._lock:
+            if not self._thread:
+                return None
+            self._stop_event.set()
+            self._thread.join()
+            self._thread = None
+            wall = time.perf_counter() - self._started_at
+        return self._dump(wall)
+
+    def toggle(self):
+        if self.running:
+            return self.stop()
+        self.start()
+        return None
+
+    def _run(self):
+        own = threading.get_ident()
+        cpu0 = time.thread_time()
+        while not self._stop_event.wait(self.interval):
+            threads = {t.ident: t for t in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                if ident == own:
+                    continue
+                thread = threads.get(ident)
+                name = thread.name if thread else f'thread-{ident}'
+                self._names[ident] = name
+                self._samples[ident] += 1
+                self._stacks[(ident, self._collapse(frame))] += 1
+                if thread:
+                    cpu = _read_thread_cpu(thread)
+                    if cpu is not None:
+                        self._cpu_first.setdefault(ident, cpu)
+                        self._cpu_last[ident] = cpu
+        self._sampler_cpu = time.thread_time() - cpu0
+
+    @staticmethod
+    def _collapse(frame):
+        parts = []
+        while frame is not None and len(parts) < MAX_DEPTH:
+            code = frame.f_code
+            parts.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+            frame = frame.f_back
+        return ';'.join(reversed(parts))
+
+    def _dump(self, wall):
+        os.makedirs(self.output_dir, exist_ok=True)
+        prefix = os.path.join(self.output_dir, time.strftime('profile-%Y%m%d-%H%M%S'))
+
+        collapsed_path = prefix + '.collapsed'
+        with open(collapsed_path, 'w', encoding='utf-8') as f:
+            for (ident, stack), count in self._stacks.most_common():
+                name = self._names.get(ident, str(ident)).replace(';', '_').replace(' ', '_')
+                f.write(f'{name};{stack} {count}\n')
+
+        overhead = self._sampler_cpu / wall * 100 if wall > 0 else 0.0
+        lines = [f'wall={wall:.3f}s interval={self.interval * 1000:.1f}ms '
+                 f'sampler_cpu={self._sampler_cpu * 1000:.1f}ms overhead={overhead:.2f}%',
+                 f'{"thread":<40} {"samples":>8} {"cpu_ms":>10} {"cpu%":>6}']
+        for ident, samples in self._samples.most_common():
+            cpu = None
+            if ident in self._cpu_first:
+                cpu = self._cpu_last[ident] - self._cpu_first[ident]
+            cpu_ms = f'{cpu * 1000:.1f}' if cpu is not None else '-'
+            cpu_pct = f'{cpu / wall * 100:.1f}' if cpu is not None and wall > 0 else '-'
+            lines.append(f'{self._names.get(ident, ident):<40} {samples:>8} {cpu_ms:>10} {cpu_pct:>6}')
+
+        with open(prefix + '.threads.txt', 'w', encoding='utf-8') as f:
+            f.write('\n'.join(lines) + '\n')
+        print('[Profiler] 采样已停止')
+        for line in lines:
+            print(f'[Profiler] {line}')
+        print(f'[Profiler] 火焰图数据已保存至: {collapsed_path}')
+        return collapsed_path
+
+
+def install_signal_toggle(profiler, on_toggle=None):
+    """
+    注册信号开关 (POSIX: SIGUSR1，Windows: SIGBREAK)。只能在主线程调用，返回所用信号。
+
+    信号处理函数只设置事件，由后台线程执行启停: 信号可能在主线程持有 profiler 的锁
+    (正在 start()/stop()) 时到达，直接在处理函数里 toggle() 会死锁。
+    on_toggle(running) 在每次启停后于该后台线程中调用
+    """
+    sig = getattr(signal, 'SIGUSR1', None) or getattr(signal, 'SIGBREAK', None)
+    if sig is None:
+        return None
+    requested = threading.Event()
+
+    def worker():
+        while True:
+            requested.wait()
+            requested.clear()
+            try:
+                profiler.toggle()
+                if on_toggle:
+                    on_toggle(profiler.running)
+            except Exception as e:
+                print(f'[Profiler] 切换采样失败: {e}')
+
+    threading.Thread(target=worker, name='ProfilerToggle', daemon=True).start()
+    signal.signal(sig, lambda signum, frame: requested.set())
+    return sig
+
+
+# ======= 开销测量 =======
+def _workload(seconds):
+    """纯 Python 计算负载，返回完成的迭代次数"""
+    deadline = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < deadline:
+        sum(i * i for i in range(200))
+        n += 1
+    return n
+
+
+def measure_overhead(seconds=3.0, threads=4, interval=DEFAULT_INTERVAL):
+    """对比开启/关闭采样时多线程负载的吞吐，返回吞吐下降百分比"""
+    def run():
+        results = []
+        workers = [threading.Thread(target=lambda: results.append(_workload(seconds)))
+                   for _ in range(threads)]
+        for w in workers:
+            w.start()
+        for w in workers:
+            w.join()
+        return sum(results)
+
+    baseline = run()
+    profiler = SamplingProfiler(interval=interval)
+    profiler.start()
+    profiled = run()
+    profiler.stop()
+    slowdown = (1 - profiled / baseline) * 100
+    print(f'[Profiler] threads={threads}, interval={interval * 1000:.1f}ms, '
+          f'throughput baseline={baseline}, profiled={profiled}, slowdown={slowdown:.2f}%')
+    return slowdown
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='采样分析器开销测量')
+    parser.add_argument('--seconds', type=float, default=3.0)
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--interval', type=float, default=DEFAULT_INTERVAL)
+    args = parser.parse_args()
+    measure_overhead(args.seconds, args.threads, args.interval)
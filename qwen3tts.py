@@ -16,12 +16,20 @@ import pyaudio
 import os
 import requests
 import base64
+import collections
+import json
 import pathlib
 import threading
 import time
 import wave
 import dashscope  # DashScope Python SDK 版本需要不低于1.23.9
 from dashscope.audio.qwen_tts_realtime import QwenTtsRealtime, QwenTtsRealtimeCallback, AudioFormat
+from audio_devices import get_manager
+from endpoints import get_selector
+from tsm import TimeStretcher, CatchUpController, DEFAULT_MAX_SPEED, DEFAULT_TARGET_LAG
+import voice_prep
+from rate_control import SampleRateController
+from resample import Resampler
 
 # ======= 常量配置 =======
 DEFAULT_TARGET_MODEL = "qwen3-tts-vc-realtime-2026-01-15"  # 声音复刻、语音合成要使用相同的模型
@@ -29,7 +37,13 @@ DEFAULT_PREFERRED_NAME = "guanyu"
 DEFAULT_AUDIO_MIME_TYPE = "audio/mpeg"
 VOICE_FILE_PATH = "voice.mp3"  # 用于声音复刻的本地音频文件的相对路径
 OUTPUT_FILE_PATH = "output.wav"  # 保存合成音频的路径
-VOICE_ID_PATH = "voice_id.txt"   # 保存生成的 voice id
+VOICE_ID_PATH = "voice_id.txt"   # 按地域保存生成的 voice id (音色只在注册它的地域可用)
+LEGACY_VOICE_REGION = "cn-beijing"  # 旧版本只保存一个 voice id，当时固定使用北京地域
+TTS_SAMPLE_RATE = 24000  # 播放设备采样率；自适应模式下其他采样率的音频重采样到该值
+BYTES_PER_SECOND = TTS_SAMPLE_RATE * 2  # 16bit 单声道
+PLAY_BLOCK_BYTES = BYTES_PER_SECOND // 50  # 分块写入 20ms，打断时最多再播放一块
+CANCEL_DRAIN_TIMEOUT = 2.0  # 关闭时等待收尾线程、后台重连线程退出的最长时间 (秒)
+DEFAULT_POOL_SIZE = 2  # TTS 连接数: 当前句播放时，下一句在另一条连接上提前合成
 
 TEXT_TO_SYNTHESIZE = [
     '对吧~我就特别喜欢这种超市，',
@@ -40,25 +54,15 @@ TEXT_TO_SYNTHESIZE = [
     '想买好多好多的东西呢！'
 ]
 
-def create_voice(file_path: str,
+def enroll_voice(file_path: str,
                  target_model: str = DEFAULT_TARGET_MODEL,
                  preferred_name: str = DEFAULT_PREFERRED_NAME,
                  audio_mime_type: str = DEFAULT_AUDIO_MIME_TYPE,
-                 force_refresh: bool = False) -> str:
+                 preprocess: bool = True) -> str:
     """
-    创建音色，并返回 voice 参数
+    上传声音样本创建音色，返回 voice 参数 (不读写本地缓存)。
+    preprocess 为 True 时先截取、重采样并压缩样本，无法解码或结果不比原文件小时上传原文件
     """
-    # 检查本地是否有缓存的 voice id
-    if not force_refresh and os.path.exists(VOICE_ID_PATH):
-        try:
-            with open(VOICE_ID_PATH, 'r', encoding='utf-8') as f:
-                voice_id = f.read().strip()
-                if voice_id:
-                    print(f"[System] 使用本地缓存的 Voice ID: {voice_id}")
-                    return voice_id
-        except Exception as e:
-            print(f"[Warning] 读取本地 Voice ID 失败: {e}")
-
     # 新加坡地域和北京地域的API Key不同。获取API Key：https://www.alibabacloud.com/help/zh/model-studio/get-api-key
     # 若没有配置环境变量，请用百炼API Key将下行替换为：api_key = "sk-xxx"
     api_key = os.environ.get('DASHSCOPE_API_KEY', "")
@@ -69,39 +73,105 @@ def create_voice(file_path: str,
     if not file_path_obj.exists():
         raise FileNotFoundError(f"音频文件不存在: {file_path}")
 
-    base64_str = base64.b64encode(file_path_obj.read_bytes()).decode()
-    data_uri = f"data:{audio_mime_type};base64,{base64_str}"
+    t0 = time.perf_counter()
+    source_bytes = file_path_obj.stat().st_size
+    prepared = None
+    if preprocess:
+        try:
+            # 无法解码时 (没有 ffmpeg 的 mp3/m4a) 由 voice_prep 打印原因
+            prepared = voice_prep.prepare(str(file_path_obj))
+        except Exception as e:
+            print(f'[Warning] 声音样本预处理失败，直接上传原文件: {e}')
+    upload = 'original'
+    if prepared is not None and len(prepared.data) >= source_bytes:
+        # 低采样率的 WAV 升到 24kHz、低码率的短 MP3 重新编码后可能反而更大，此时上传原文件
+        upload = f'original (prepared={len(prepared.data) / 1024:.0f}KB not smaller)'
+        prepared = None
+    if prepared is not None:
+        upload = 'prepared'
+        audio, audio_mime_type = prepared.data, prepared.mime_type
+    else:
+        audio = file_path_obj.read_bytes()
 
-    # 以下为新加坡地域url，若使用北京地域的模型，需将url替换为：https://dashscope.aliyuncs.com/api/v1/services/audio/tts/customization
-    url = "https://dashscope.aliyuncs.com/api/v1/services/audio/tts/customization"
+    # 地域由测速结果决定，见 endpoints.py
+    url = get_selector().customization_url()
     payload = {
         "model": "qwen-voice-enrollment", # 不要修改该值
         "input": {
             "action": "create",
             "target_model": target_model,
             "preferred_name": preferred_name,
-            "audio": {"data": data_uri}
+            "audio": {"data": voice_prep.DataUriBody.PLACEHOLDER}
         }
     }
     headers = {
         "Authorization": f"Bearer {api_key}",
         "Content-Type": "application/json"
     }
+    # 请求体边发送边做 base64 编码，不在内存中拼出完整的 data URI
+    body = voice_prep.DataUriBody(payload, audio, audio_mime_type)
 
-    resp = requests.post(url, json=payload, headers=headers)
+    t1 = time.perf_counter()
+    resp = requests.post(url, data=body, headers=headers)
+    t2 = time.perf_counter()
+    print(f'[Metric] enrollment upload={upload}, payload={len(body) / 1024:.0f}KB '
+          f'(raw={voice_prep.base64_size(source_bytes) / 1024:.0f}KB), '
+          f'audio={prepared.seconds if prepared else 0:.1f}s, '
+          f'prep={(t1 - t0) * 1000:.0f}ms, request={(t2 - t1) * 1000:.0f}ms, total={(t2 - t0) * 1000:.0f}ms')
     if resp.status_code != 200:
         raise RuntimeError(f"创建 voice 失败: {resp.status_code}, {resp.text}")
 
     try:
-        voice_id = resp.json()["output"]["voice"]
-        # 保存 voice id 到本地
-        with open(VOICE_ID_PATH, 'w', encoding='utf-8') as f:
-            f.write(voice_id)
-        print(f"[System] 新建 Voice ID 已保存: {voice_id}")
-        return voice_id
+        return resp.json()["output"]["voice"]
     except (KeyError, ValueError) as e:
         raise RuntimeError(f"解析 voice 响应失败: {e}")
 
+def _load_voice_ids():
+    """读取本地缓存的 voice id，返回 {地域名: voice id}"""
+    if not os.path.exists(VOICE_ID_PATH):
+        return {}
+    try:
+        with open(VOICE_ID_PATH, 'r', encoding='utf-8') as f:
+            text = f.read().strip()
+    except Exception as e:
+        print(f"[Warning] 读取本地 Voice ID 失败: {e}")
+        return {}
+    if not text:
+        return {}
+    try:
+        voice_ids = json.loads(text)
+    except ValueError:
+        # 旧格式: 文件中只有一个 voice id
+        return {LEGACY_VOICE_REGION: text}
+    return voice_ids if isinstance(voice_ids, dict) else {}
+
+def create_voice(file_path: str,
+                 target_model: str = DEFAULT_TARGET_MODEL,
+                 preferred_name: str = DEFAULT_PREFERRED_NAME,
+                 audio_mime_type: str = DEFAULT_AUDIO_MIME_TYPE,
+                 force_refresh: bool = False) -> str:
+    """
+    在当前地域创建音色，并返回 voice 参数。之后地域选择固定为该地域
+    """
+    region = get_selector().region_name()
+    voice_ids = _load_voice_ids()
+    # 检查本地是否有该地域缓存的 voice id
+    voice_id = None if force_refresh else voice_ids.get(region)
+    if voice_id:
+        print(f"[System] 使用本地缓存的 Voice ID ({region}): {voice_id}")
+    else:
+        if voice_ids and not force_refresh:
+            print(f"[System] 本地缓存的 Voice ID 不属于当前地域 {region}，重新创建")
+        voice_id = enroll_voice(file_path, target_model, preferred_name, audio_mime_type)
+        # 保存 voice id 到本地
+        voice_ids[region] = voice_id
+        with open(VOICE_ID_PATH, 'w', encoding='utf-8') as f:
+            json.dump(voice_ids, f, indent=4, ensure_ascii=False)
+        print(f"[System] 新建 Voice ID 已保存 ({region}): {voice_id}")
+    # 音色只在该地域可用，重新测速时不切换到其他地域，TTS 与 ASR 都留在该地域
+    get_selector().pin(region)
+    return voice_id
+
 def init_dashscope_api_key():
     """
     初始化 dashscope SDK 的 API key
@@ -112,145 +182,729 @@ def init_dashscope_api_key():
     if not dashscope.api_key:
         print('[Warning] DASHSCOPE_API_KEY is not set. Please set it in environment variables or config.')
 
+class WavWriter:
+    """保存合成音频的 WAV 文件。连接池中的各连接共用一个，按播放顺序写入"""
+    def __init__(self, path=OUTPUT_FILE_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = wave.open(path, 'wb')
+        self._file.setnchannels(1)
+        self._file.setsampwidth(pyaudio.get_sample_size(pyaudio.paInt16))
+        self._file.setframerate(TTS_SAMPLE_RATE)
+
+    def write(self, audio_data):
+        with self._lock:
+            if self._file:
+                self._file.writeframes(audio_data)
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+                print(f'[TTS] 音频已保存至: {self.path}')
+
 # ======= 回调类 =======
 class MyCallback(QwenTtsRealtimeCallback):
     """
     自定义 TTS 流式回调
     """
-    def __init__(self, output_device_index=None):
+    def __init__(self, output_device_index=None, catchup=None, output_stream=None, wav=None):
         self.complete_event = threading.Event()
-        self._player = pyaudio.PyAudio()
-        self._stream = self._player.open(
-            format=pyaudio.paInt16, 
-            channels=1, 
-            rate=24000, 
-            output=True,
-            output_device_index=output_device_index
-        )
-        self._wav_file = wave.open(OUTPUT_FILE_PATH, 'wb')
-        self._wav_file.setnchannels(1)
-        self._wav_file.setsampwidth(self._player.get_sample_size(pyaudio.paInt16))
-        self._wav_file.setframerate(24000)
+        self.first_audio_time = None  # 本次合成收到首个音频包的时间 (perf_counter)
+        # 追赶播放: catchup 为 None 时不做时间伸缩
+        self.catchup = catchup
+        self.stretcher = TimeStretcher()
+        self.utterance_origin = time.perf_counter()  # 说话人说完这句话的时间
+        self.consumed = 0.0  # 本句已播放的原始音频时长 (秒)
+        self.max_speed = 1.0
+        # 打断 (barge-in)
+        self.cancel_event = threading.Event()
+        self.silenced = threading.Event()
+        self.cancel_requested_at = None  # 检测到新语音的时间
+        self.silenced_at = None          # 停止写入播放设备的时间
+        self.writing = False
+        # 双缓冲: hold() 之后收到的音频先缓存，轮到本句时由 release() 按顺序播放
+        self.held = False
+        self._pending = collections.deque()
+        self._hold_lock = threading.Lock()
+        self._response_done = False
+        self.played = threading.Event()  # 本句音频已全部写入播放设备 (或已打断)
+        self.first_play_time = None      # 本句第一块音频写入播放设备的时间
+        self.ended_at = None             # 本句预计在设备上播放完毕的时间
+        # 本句请求的采样率，与设备采样率不同时重采样后再播放
+        self.source_rate = TTS_SAMPLE_RATE
+        self._resampler = None
+        # 到达速度统计: 首包之后收到的音频时长，以及等待网络的时间 (不含阻塞在播放上的时间)
+        self.arrived_seconds = 0.0
+        self.network_seconds = 0.0
+        self._handled_at = None
+        self.underruns = 0
+        self._underruns_at_start = 0
+        if output_stream is None:
+            # 从进程级设备管理器借用常开的输出流，重连时无需重新打开设备
+            self._stream = get_manager().output_stream(output_device_index, TTS_SAMPLE_RATE)
+            self._borrowed = True
+        else:
+            # 由调用方提供输出流 (例如基准测试中的空输出)
+            self._stream = output_stream
+            self._borrowed = False
+        # 播放的音频同时写入 wav (WavWriter)，为 None 时不保存
+        self._wav = wav
+        self._close_lock = threading.Lock()
+        # 连接已关闭 (服务端在 finish() 之后或空闲超时时关闭)，该连接不能再用于下一句
+        self.closed = False
 
     def on_open(self) -> None:
         print('[TTS] 连接已建立')
 
     def on_close(self, close_status_code, close_msg) -> None:
-        self._stream.stop_stream()
-        self._stream.close()
-        self._player.terminate()
-        if self._wav_file:
-            self._wav_file.close()
-            print(f'[TTS] 音频已保存至: {OUTPUT_FILE_PATH}')
+        # 只做标记: 缓存中可能还有未播放的音频，输出流由 TTSClient 重建或关闭连接时归还
+        self.closed = True
+        if not self._response_done:
+            # 未收到 response.done 就断开时结束本句，避免后面的句子一直等待
+            self._response_done = True
+            self._flush_resampler()
+            self._deliver(None)
+        self.complete_event.set()
         print(f'[TTS] 连接关闭 code={close_status_code}, msg={close_msg}')
 
+    def close(self):
+        """归还输出流，由 TTSClient 关闭连接时调用，可重复调用。WAV 文件由 TTSClient 关闭"""
+        with self._close_lock:
+            if self._borrowed:
+                # 归还输出流，设备保持打开
+                get_manager().release(self._stream)
+                self._borrowed = False
+
     def on_event(self, response: dict) -> None:
         try:
             event_type = response.get('type', '')
             if event_type == 'session.created':
                 print(f'[TTS] 会话开始: {response["session"]["id"]}')
             elif event_type == 'response.audio.delta':
+                if self.cancel_event.is_set():
+                    # 已打断，丢弃剩余音频
+                    self._mark_silenced()
+                    return
+                now = time.perf_counter()
                 audio_data = base64.b64decode(response['delta'])
-                self._stream.write(audio_data)
-                if self._wav_file:
-                    self._wav_file.writeframes(audio_data)
+                if self.first_audio_time is None:
+                    self.first_audio_time = now
+                else:
+                    self.arrived_seconds += len(audio_data) / (2 * self.source_rate)
+                    self.network_seconds += now - self._handled_at
+                if self._resampler is not None:
+                    audio_data = self._resampler.process_pcm(audio_data)
+                self._output(audio_data)
+                self._handled_at = time.perf_counter()
             elif event_type == 'response.done':
+                self._response_done = True
+                self._flush_resampler()
+                self._deliver(None)
                 print(f'[TTS] 响应完成, Response ID: {qwen_tts_realtime.get_last_response_id()}')
             elif event_type == 'session.finished':
                 print('[TTS] 会话结束')
+                if not self._response_done:
+                    # 没有收到 response.done 时也要结束本句，避免后面的句子一直等待
+                    self._response_done = True
+                    self._flush_resampler()
+                    self._deliver(None)
                 self.complete_event.set()
         except Exception as e:
             print(f'[Error] 处理回调事件异常: {e}')
 
+    def begin_utterance(self, origin, source_rate=TTS_SAMPLE_RATE):
+        """开始新的一句，origin 为该句文本识别完成的时间，source_rate 为本句请求的采样率"""
+        self.source_rate = source_rate
+        self._resampler = Resampler(source_rate, TTS_SAMPLE_RATE) if source_rate != TTS_SAMPLE_RATE else None
+        self.arrived_seconds = 0.0
+        self.network_seconds = 0.0
+        self._handled_at = None
+        self.underruns = 0
+        self.utterance_origin = origin
+        self.consumed = 0.0
+        self.max_speed = 1.0
+        self.stretcher.reset()
+        self.cancel_event.clear()
+        self.silenced.clear()
+        self.cancel_requested_at = None
+        self.silenced_at = None
+        with self._hold_lock:
+            self.held = False
+            self._pending.clear()
+        self._response_done = False
+        self.played.clear()
+        self.first_play_time = None
+        self.ended_at = None
+
+    def hold(self):
+        """之后收到的音频先缓存，不写入播放设备，直到 release()"""
+        with self._hold_lock:
+            self.held = True
+
+    def release(self):
+        """在调用线程中按顺序播放已缓存的音频，之后恢复为收到即播放"""
+        while True:
+            with self._hold_lock:
+                if not self._pending:
+                    self.held = False
+                    return
+                audio_data = self._pending.popleft()
+            if audio_data is not None and self.cancel_event.is_set():
+                # 已打断: 丢弃缓存的音频，不触碰此时可能已属于下一句的输出流
+                continue
+            self._deliver_now(audio_data)
+
+    def _output(self, audio_data):
+        if audio_data:
+            self._deliver(audio_data)
+
+    def _flush_resampler(self):
+        """输出重采样器中剩余的音频 (被打断时丢弃)"""
+        if self._resampler is not None and not self.cancel_event.is_set():
+            self._output(self._resampler.flush_pcm())
+
+    def _stream_underruns(self):
+        try:
+            return getattr(self._stream, 'underruns', 0)
+        except Exception:
+            return 0
+
+    def arrival_ratio(self):
+        """本句音频到达速度相对实时的倍数"""
+        return SampleRateController.arrival_ratio(self.arrived_seconds, self.network_seconds)
+
+    def _deliver(self, audio_data):
+        """播放一段音频，audio_data 为 None 表示本句结束"""
+        with self._hold_lock:
+            if self.held:
+                self._pending.append(audio_data)
+                return
+        self._deliver_now(audio_data)
+
+    def _deliver_now(self, audio_data):
+        if audio_data is None:
+            self._end_response()
+        else:
+            # 在播放时写入 WAV (时间伸缩之前)，各连接共用的文件中句子顺序与播放顺序一致
+            if self._wav is not None:
+                self._wav.write(audio_data)
+            self._play(audio_data)
+
+    def _end_response(self):
+        if self.cancel_event.is_set():
+            # 输出流已在 cancel() 时清空，这里不再操作，避免影响之后的句子
+            self.stretcher.reset()
+            self.ended_at = time.perf_counter()
+            self.played.set()
+            return
+        if self.stretcher.active:
+            self._write(self.stretcher.flush())
+        self._stream.mark_active(False)
+        if self.first_play_time is not None:
+            self.underruns = self._stream_underruns() - self._underruns_at_start
+        try:
+            buffered = self._stream.buffered_seconds()
+        except Exception:
+            buffered = 0.0
+        self.ended_at = time.perf_counter() + buffered
+        self.played.set()
+
+    def cancel(self, requested_at):
+        """打断本句: 停止消费音频包并尽快停止播放；尚未轮到播放的句子只丢弃缓存"""
+        self.cancel_requested_at = requested_at
+        self.cancel_event.set()
+        with self._hold_lock:
+            held = self.held
+            self._pending = collections.deque(a for a in self._pending if a is None)
+        if not held:
+            self._stream.mark_active(False)
+            # 丢弃输出流中尚未播放的音频
+            self._stream.flush()
+        if not self.writing:
+            self._mark_silenced()
+
+    def _mark_silenced(self):
+        if not self.silenced.is_set():
+            self.silenced_at = time.perf_counter()
+            self.silenced.set()
+
+    def output_latency(self):
+        """播放设备自身缓冲带来的延迟 (秒)"""
+        try:
+            return self._stream.get_output_latency()
+        except Exception:
+            return 0.0
+
+    def lag(self):
+        """当前播放位置落后于说话人的时间 (秒)"""
+        return time.perf_counter() - self.utterance_origin - self.consumed
+
+    def _play(self, audio_data):
+        if self.first_play_time is None:
+            self.first_play_time = time.perf_counter()
+            self._underruns_at_start = self._stream_underruns()
+            self._stream.mark_active(True)
+        if self.catchup is not None:
+            speed = self.catchup.update(self.lag())
+            self.max_speed = max(self.max_speed, speed)
+            self.consumed += len(audio_data) / BYTES_PER_SECOND
+            if speed > 1.0:
+                audio_data = self.stretcher.process(audio_data, speed)
+            elif self.stretcher.active:
+                # 恢复原速: 输出伸缩器中剩余的样本后直接播放，不再经过 WSOLA
+                audio_data = self.stretcher.flush() + audio_data
+        self._write(audio_data)
+
+    def _write(self, audio_data):
+        """分块写入播放设备，每块之间检查是否被打断"""
+        self.writing = True
+        try:
+            view = memoryview(audio_data)
+            for i in range(0, len(view), PLAY_BLOCK_BYTES):
+                if self.cancel_event.is_set():
+                    self._stream.flush()
+                    self._mark_silenced()
+                    return
+                self._stream.write(bytes(view[i:i + PLAY_BLOCK_BYTES]))
+        finally:
+            self.writing = False
+
+    def wait_until_played(self):
+        """等待本句音频全部写入播放设备；被打断时立即返回 False"""
+        while not self.played.wait(0.02):
+            if self.cancel_event.is_set():
+                return False
+        return not self.cancel_event.is_set()
+
     def wait_for_finished(self):
-        self.complete_event.wait()
+        """等待本句播放完毕且会话结束；被打断时立即返回 False"""
+        if not self.wait_until_played():
+            return False
+        while not self.complete_event.wait(0.02):
+            if self.cancel_event.is_set():
+                return False
+        return True
 
-class TTSClient:
-    def __init__(self, voice_file_path=VOICE_FILE_PATH, output_device_index=None):
-        init_dashscope_api_key()
+class _Lane:
+    """连接池中的一条 TTS 连接，以及它正在合成的一句话"""
+    def __init__(self, index):
+        self.index = index
         self.client = None
         self.callback = None
+        self.region = None
+        self.busy = False    # 已分配给一句话，该句结束前不能复用
+        self.failed = False  # 发送请求时出错，结束后需要重建连接
+        self.enqueued_at = None
+        self.text_sent_at = None  # 本句首次发送文本的时间，用于计算本句的首包延迟
+        self.switch_requested_at = None
+        self.switch_applied_at = None
+
+class TTSClient:
+    def __init__(self, voice_file_path=VOICE_FILE_PATH, output_device_index=None,
+                 catchup=True, catchup_max_speed=DEFAULT_MAX_SPEED,
+                 catchup_target_lag=DEFAULT_TARGET_LAG, catchup_trace_path=None,
+                 output_stream=None, pool_size=DEFAULT_POOL_SIZE, adaptive_rate=False):
+        init_dashscope_api_key()
         self.output_device_index = output_device_index
+        # 指定时使用该输出流 (例如独立音频进程的播放通道)，否则从设备管理器借用
+        self.output_stream = output_stream
+        # 积压时加速播放，延迟低于 catchup_target_lag 后恢复原速
+        self.catchup = CatchUpController(max_speed=catchup_max_speed,
+                                         target_lag=catchup_target_lag) if catchup else None
+        self.catchup_trace_path = catchup_trace_path
+        # 自适应采样率: 根据音频包到达速度在句子边界切换请求的采样率，高于设备采样率没有意义
+        self.rate_controller = SampleRateController(initial=TTS_SAMPLE_RATE,
+                                                    max_rate=TTS_SAMPLE_RATE) if adaptive_rate else None
         # 预先获取 voice_id
         self.voice_id = create_voice(voice_file_path)
+        # 待切换的音色: (voice_id, 请求时间)，在下一句合成开始时生效
+        self._pending_voice = None
+        self._voice_lock = threading.Lock()
+        # 连接池: 当前句播放时，下一句在另一条连接上合成并缓存，上一句播完后立即接上。
+        # pool_size=1 时与单连接相同，synthesize 在播放结束后才返回
+        self.pool_size = max(1, pool_size)
+        self._lanes = [_Lane(i) for i in range(self.pool_size)]
+        self._inflight = collections.deque()  # 按播放顺序排列的未结束的句子
+        self._cond = threading.Condition()
+        self._finisher = None
+        self._refreshers = []  # 句子结束后在后台重建连接的线程
+        self._wav = None  # 所有连接共用的 WAV 文件，第一次建立连接时打开
+        self._closed = False
+        # 句间间隔: 下一句在上一句播完前已识别完成时，上一句结束到下一句开始播放的时间
+        self._last_end = None
+        self._gap_count = 0
+        self._gap_total = 0.0
+        self._gap_max = 0.0
+
+    @property
+    def speaking(self):
+        """有句子正在合成或播放"""
+        with self._cond:
+            return bool(self._inflight)
+
+    def set_voice(self, voice_id):
+        """
+        热切换音色。不重建连接，新音色在下一句合成开始时通过 update_session 生效
+        """
+        with self._voice_lock:
+            self._pending_voice = (voice_id, time.perf_counter())
+        print(f'[TTS] 音色切换已排队，将在下一句生效: {voice_id}')
+
+    def _take_pending_voice(self):
+        """取出待切换的音色并应用，返回切换请求时间；无切换时返回 None"""
+        with self._voice_lock:
+            pending, self._pending_voice = self._pending_voice, None
+        if pending is None:
+            return None
+        self.voice_id = pending[0]
+        return pending[1]
 
     def connect(self):
-        if self.client:
+        """建立连接池中的全部连接，并启动按顺序衔接播放的后台线程"""
+        with self._cond:
+            self._closed = False
+        for lane in self._lanes:
+            self._connect_lane(lane)
+        self._start_finisher()
+
+    def _start_finisher(self):
+        with self._cond:
+            if self._finisher is None and not self._closed:
+                self._finisher = threading.Thread(target=self._run_finisher, name='TTSFinisher', daemon=True)
+                self._finisher.start()
+
+    def _connect_lane(self, lane):
+        if lane.client:
             return
 
-        print('[TTS] Connecting...')
-        self.callback = MyCallback(output_device_index=self.output_device_index)
-        self.client = QwenTtsRealtime(
+        print(f'[TTS] Connecting (lane {lane.index})...')
+        with self._cond:
+            if self._wav is None:
+                self._wav = WavWriter(OUTPUT_FILE_PATH)
+            wav = self._wav
+        lane.callback = MyCallback(output_device_index=self.output_device_index, catchup=self.catchup,
+                                   output_stream=self.output_stream, wav=wav)
+        region = get_selector().select()
+        lane.region = region['name']
+        lane.client = QwenTtsRealtime(
             model=DEFAULT_TARGET_MODEL,
-            callback=self.callback,
-            # 以下为新加坡地域url，若使用北京地域的模型，需将url替换为：wss://dashscope.aliyuncs.com/api-ws/v1/realtime
-            url='wss://dashscope.aliyuncs.com/api-ws/v1/realtime'
+            callback=lane.callback,
+            # 地域由测速结果决定，见 endpoints.py
+            url=region['ws_url']
         )
-        self.client.connect()
-        print('[TTS] Connected.')
+        lane.client.connect()
+        print(f'[TTS] Connected (lane {lane.index}, {lane.region}).')
+
+    def _reconnect(self, lane):
+        """关闭该连接并重新建立"""
+        self._close_lane(lane)
+        self._connect_lane(lane)
+
+    def _close_lane(self, lane):
+        """关闭该连接的 websocket，并归还输出流、写完 WAV 文件 (不依赖 on_close 是否被回调)"""
+        client, callback = lane.client, lane.callback
+        lane.client = None
+        lane.callback = None
+        if client:
+            try:
+                client.close()
+            except Exception as e:
+                print(f'[TTS] Error closing: {e}')
+        if callback:
+            callback.close()
 
     def close(self):
-        if self.client:
-            # 这里的close逻辑取决于SDK，通常没有显式的close方法在QwenTtsRealtime? 
-            # 假设不需要显式close client对象，或者client会自动处理
-            # 这里的callback有close资源
-            pass
-        # 重新创建callback意味着重置pyaudio等
-        # 目前MyCallback在__init__里开了pyaudio，在on_close里关了。
-        # 如果连接断了，on_close被调用，pyaudio被关了。
-        # 下次connect需要新的callback。
-        self.client = None
-        self.callback = None
+        with self._cond:
+            self._closed = True
+            pending = list(self._inflight)
+            self._cond.notify_all()
+        # 丢弃尚未播放完的句子
+        for lane in pending:
+            if lane.callback:
+                lane.callback.cancel(time.perf_counter())
+        if self._finisher:
+            self._finisher.join(timeout=CANCEL_DRAIN_TIMEOUT)
+            if self._finisher.is_alive():
+                print('[Warning] TTS 收尾线程未能及时退出')
+            self._finisher = None
+        with self._cond:
+            refreshers, self._refreshers = self._refreshers, []
+        for thread in refreshers:
+            thread.join(timeout=CANCEL_DRAIN_TIMEOUT)
+            if thread.is_alive():
+                print('[Warning] TTS 重建连接的线程未能及时退出')
+        with self._cond:
+            self._inflight.clear()
+            for lane in self._lanes:
+                lane.busy = False
+        for lane in self._lanes:
+            self._close_lane(lane)
+        with self._cond:
+            wav, self._wav = self._wav, None
+        if wav:
+            wav.close()
+        if self._gap_count:
+            print(f'[Metric] utterance_gap pool={self.pool_size}, count={self._gap_count}, '
+                  f'avg={self._gap_total / self._gap_count * 1000:.0f}ms, max={self._gap_max * 1000:.0f}ms')
+        if self.catchup and self.catchup_trace_path:
+            self.catchup.dump_trace(self.catchup_trace_path)
 
-    def synthesize(self, text):
-        if not self.client:
-            self.connect()
+    def cancel(self, speech_started_at=None):
+        """
+        打断 (barge-in): 正在播放的一句以及已提前合成、尚未播放的后续句子全部丢弃，
+        停止播放，并通知服务端取消各自的响应。
+        speech_started_at 为检测到新语音的时间 (perf_counter)，用于统计打断延迟
+        """
+        with self._cond:
+            lanes = [l for l in self._inflight if l.callback and not l.callback.cancel_event.is_set()]
+        if not lanes:
+            return False
+        if speech_started_at is None:
+            speech_started_at = time.perf_counter()
+        for lane in lanes:
+            lane.callback.cancel(speech_started_at)
+        print('[TTS] 检测到新语音，打断当前播放'
+              + (f'，丢弃 {len(lanes) - 1} 句已提前合成的句子' if len(lanes) > 1 else ''))
+        for lane in lanes:
+            try:
+                lane.client.cancel_response()
+            except Exception as e:
+                print(f'[TTS] 取消响应失败: {e}')
+        return True
 
-        # 重置完成事件
-        self.callback.complete_event.clear()
+    @staticmethod
+    def _lane_alive(lane):
+        """该连接可以用于下一句: 没有收到关闭回调，且 websocket 仍处于连接状态"""
+        if lane.client is None or lane.callback is None or lane.callback.closed:
+            return False
+        ws = getattr(lane.client, 'ws', None)
+        if ws is None:
+            return True
+        sock = getattr(ws, 'sock', None)
+        return sock is not None and bool(getattr(sock, 'connected', False))
 
-        # sample_rate for tts, range [8000,16000,24000,48000]
-        # volume for tts, range [0,100] default is 50
+    def _start_session(self, lane, sample_rate):
+        """
+        在该连接上开始新的一句。连接已断开时先重连；更新会话失败时重连后重试一次，
+        此时文本还未发出，重试不会重复合成
+        """
+        for attempt in range(2):
+            try:
+                if not self._lane_alive(lane):
+                    if lane.client:
+                        print(f'[TTS] 连接已断开，重新连接 (lane {lane.index})')
+                    self._reconnect(lane)
+
+                # sample_rate for tts, range [8000,16000,24000,48000]
+                # volume for tts, range [0,100] default is 50
+                lane.client.update_session(
+                    voice=self.voice_id,
+                    response_format=AudioFormat.PCM_24000HZ_MONO_16BIT,
+                    sample_rate=sample_rate,
+                    volume=100,
+                    mode='server_commit'
+                )
+                return
+            except Exception as e:
+                self._close_lane(lane)
+                if attempt:
+                    raise
+                print(f'[TTS] 更新会话失败，重新连接后重试 (lane {lane.index}): {e}')
+
+    def _refresh_lane(self, lane):
+        """
+        一句结束后在后台重建该连接再归还: finish() 之后服务端会关闭连接，
+        被打断或出错的连接也不再复用，下一句拿到的是已建立好的新连接
+        """
+        try:
+            with self._cond:
+                closed = self._closed
+            if closed:
+                return
+            self._reconnect(lane)
+        except Exception as e:
+            # 重连失败时保持未连接状态，下一句使用该连接时再尝试
+            print(f'[TTS] 重建连接失败 (lane {lane.index}): {e}')
+            self._close_lane(lane)
+        finally:
+            self._free_lane(lane)
+
+    def _recycle_lane(self, lane):
+        thread = threading.Thread(target=self._refresh_lane, args=(lane,),
+                                  name=f'TTSReconnect-{lane.index}', daemon=True)
+        with self._cond:
+            self._refreshers = [t for t in self._refreshers if t.is_alive()]
+            self._refreshers.append(thread)
+        thread.start()
+
+    def _report_barge_in(self, callback):
+        if not callback.silenced.wait(0.5):
+            print('[Metric] barge_in 未能在 500ms 内停止播放')
+            return
+        stop_write = callback.silenced_at - callback.cancel_requested_at
+        device = callback.output_latency()
+        print(f'[Metric] barge_in speech_start_to_silence={(stop_write + device) * 1000:.0f}ms '
+              f'(stop_write={stop_write * 1000:.0f}ms, device_buffer={device * 1000:.0f}ms)')
+
+    def _acquire_lane(self):
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or any(not l.busy for l in self._lanes))
+            if self._closed:
+                raise RuntimeError('TTSClient 已关闭')
+            lane = next(l for l in self._lanes if not l.busy)
+            lane.busy = True
+            lane.failed = False
+            return lane
+
+    def _free_lane(self, lane):
+        with self._cond:
+            lane.busy = False
+            self._cond.notify_all()
+
+    def wait_until_idle(self, timeout=None):
+        """等待所有已提交的句子播放完毕 (并且各连接已在后台重建)"""
+        with self._cond:
+            return self._cond.wait_for(lambda: not any(l.busy for l in self._lanes), timeout)
+
+    def synthesize(self, text, enqueued_at=None):
+        """
+        合成一句话并按提交顺序播放。enqueued_at 为该句识别完成的时间 (perf_counter)，用于计算延迟。
+        连接池中还有空闲连接时，请求发出后即返回，下一句可以在本句播放期间开始合成；
+        没有空闲连接时等待最早的一句结束 (pool_size=1 时即等待本句播放完毕或被 cancel() 打断)
+        """
+        if enqueued_at is None:
+            enqueued_at = time.perf_counter()
+        self._start_finisher()
+        lane = self._acquire_lane()
+        # 采样率在请求时读取，而决策在一句播完后才做出: 连接池提前请求的句子仍用旧采样率，
+        # 切换要到 pool_size 句之后才生效
+        sample_rate = self.rate_controller.rate if self.rate_controller else TTS_SAMPLE_RATE
+        # 在句子边界应用待切换的音色
+        lane.switch_requested_at = self._take_pending_voice()
+        lane.switch_applied_at = time.perf_counter()
         try:
-            self.client.update_session(
-                voice=self.voice_id,
-                response_format=AudioFormat.PCM_24000HZ_MONO_16BIT,
-                volume=100,
-                mode='server_commit'
-            )
+            self._start_session(lane, sample_rate)
+        except Exception as e:
+            print(f"[TTS] Error: {e}")
+            self._free_lane(lane)
+            raise e
 
+        callback = lane.callback
+        # 重置完成事件
+        callback.complete_event.clear()
+        callback.first_audio_time = None
+        callback.begin_utterance(enqueued_at, sample_rate)
+        lane.enqueued_at = enqueued_at
+        lane.text_sent_at = None
+        with self._cond:
+            # 前面还有未播完的句子时先缓存音频，轮到本句时再接着播放
+            if self._inflight:
+                callback.hold()
+            self._inflight.append(lane)
+            self._cond.notify_all()
+
+        try:
             print(f'[发送文本]: {text}')
-            self.client.append_text(text)
+            lane.text_sent_at = time.perf_counter()
+            lane.client.append_text(text)
             time.sleep(0.1)
 
-            self.client.finish()
-            self.callback.wait_for_finished()
-            
-            print(f'[Metric] session_id={self.client.get_session_id()}, '
-                  f'first_audio_delay={self.client.get_first_audio_delay()}s')
-            
+            lane.client.finish()
         except Exception as e:
             print(f"[TTS] Error: {e}")
-            self.close()
+            # 交给后台线程结束本句并重建该连接，后面的句子照常播放
+            lane.failed = True
+            callback.cancel_event.set()
             raise e
 
+        # 等待出现空闲连接，供下一句使用
+        with self._cond:
+            self._cond.wait_for(lambda: self._closed or any(not l.busy for l in self._lanes))
+
+    def _run_finisher(self):
+        """按播放顺序等待每一句播完: 把播放交给下一句，汇报指标并归还连接"""
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._inflight or self._closed)
+                if self._closed:
+                    return
+                lane = self._inflight[0]
+            callback = lane.callback
+            played = callback.wait_until_played()
+            with self._cond:
+                if self._inflight and self._inflight[0] is lane:
+                    self._inflight.popleft()
+                successor = self._inflight[0] if self._inflight else None
+            if successor:
+                # 在单独的线程中写入后续句子已缓存的音频，本线程继续处理本句的收尾
+                threading.Thread(target=successor.callback.release, name='TTSHandoff', daemon=True).start()
+
+            if lane.failed:
+                self._last_end = None
+            elif not played:
+                self._last_end = None
+                # 只有已开始播放的句子才有打断延迟可统计
+                if not self._closed and callback.first_play_time is not None:
+                    self._report_barge_in(callback)
+            elif callback.wait_for_finished():
+                self._report(lane)
+            self._recycle_lane(lane)
+
+    def _report(self, lane):
+        callback = lane.callback
+        # SDK 的 get_first_audio_delay() 每个连接只记录一次，连接复用后需按句自行计算
+        first_audio_delay = None
+        if lane.text_sent_at is not None and callback.first_audio_time is not None:
+            first_audio_delay = (callback.first_audio_time - lane.text_sent_at) * 1000
+        print(f'[Metric] session_id={lane.client.get_session_id()}, first_audio_delay='
+              + (f'{first_audio_delay:.0f}ms' if first_audio_delay is not None else '-'))
+        # 过慢时在后台线程重新测速，不阻塞播放
+        get_selector().record_first_audio_delay(first_audio_delay)
+        if self.catchup:
+            print(f'[Metric] catchup lag={callback.lag():.2f}s, '
+                  f'max_speed={callback.max_speed:.2f}x')
+        if self.rate_controller:
+            print(f'[Metric] tts_rate={callback.source_rate}Hz, arrival={callback.arrival_ratio():.2f}x, '
+                  f'underruns={callback.underruns}')
+            new_rate, reason = self.rate_controller.update(callback.arrived_seconds, callback.network_seconds,
+                                                           callback.underruns, rate=callback.source_rate)
+            if reason:
+                print(f'[Rate] {callback.source_rate}Hz -> {new_rate}Hz: {reason}')
+        if lane.switch_requested_at is not None and callback.first_audio_time is not None:
+            # 排队等待: 请求到句子边界; 生效: 句子边界到新音色首个音频包
+            print(f'[Metric] voice_switch voice={self.voice_id}, '
+                  f'queued={lane.switch_applied_at - lane.switch_requested_at:.3f}s, '
+                  f'first_audio={callback.first_audio_time - lane.switch_applied_at:.3f}s, '
+                  f'total={callback.first_audio_time - lane.switch_requested_at:.3f}s')
+
+        previous_end, self._last_end = self._last_end, callback.ended_at
+        if previous_end is not None and callback.first_play_time is not None \
+                and lane.enqueued_at < previous_end:
+            # 本句在上一句播完前就已识别完成，两句之间的静音完全来自合成
+            gap = max(0.0, callback.first_play_time - previous_end)
+            self._gap_count += 1
+            self._gap_total += gap
+            self._gap_max = max(self._gap_max, gap)
+            print(f'[Metric] utterance_gap={gap * 1000:.0f}ms (pool={self.pool_size}, lane={lane.index})')
+
 def synthesize_text(text):
     """Legacy function"""
     client = TTSClient()
     try:
         client.synthesize(text)
+        client.wait_until_idle()
     except Exception as e:
         print(f"Error in TTS: {e}")
-    # 注意：MyCallback的on_close会关闭pyaudio，这里如果client不复用，
-    # 实际上每次都会创建新的pyaudio。
-    # 如果复用client，MyCallback也会复用，pyaudio保持打开。
-    # 但是QwenTtsRealtime的finish之后，连接是否还可用？
-    # 假设finish后连接可用（Session结束，Connection保持）。
-    # 如果不可用，上面的异常处理会触发close，下次connect。
+    # 注意：输出设备由 audio_devices 的管理器持有，client 不复用也不会重新打开设备。
+    # QwenTtsRealtime 的 finish 之后服务端会关闭连接，TTSClient 在每句结束后于后台重建连接。
     
 # ======= 主执行逻辑 =======
 if __name__ == '__main__':
     client = TTSClient()
     client.connect()
     for text_chunk in TEXT_TO_SYNTHESIZE:
-        client.synthesize(text_chunk)
\ No newline at end of file
+        client.synthesize(text_chunk)
+    client.wait_until_idle()
+    client.close()
\ No newline at end of file
@@ -0,0 +1,127 @@
+# coding=utf-8
+"""
+TTS 输出采样率自适应。
+
+链路较差时 24kHz 的音频包 (48KB/s) 到达得比播放还慢，播放会欠载。SampleRateController
+在每句结束时根据音频包的到达速度 (相对实时的倍数) 和欠载次数，在句子边界上调整下一句
+请求的采样率；播放端统一重采样到设备采样率，切换时听不到设备重开或变调。
+
+到达速度 = 本句音频时长 / 等待网络的时间。回调线程阻塞在写入播放设备上的时间不计入，
+否则链路再快，测得的速度也会被播放速度限制在 1 倍左右。
+
+决策在一句播放结束后做出，而 TTS 连接池会在当前句播放期间提前请求后面的句子，
+因此新的采样率要到 pool_size 句之后才生效 (pool_size=1 时即下一句)。update() 的 rate 参数
+为被测句子请求时的采样率，切换之前已请求的句子不参与决策，否则降档后第一句仍是旧采样率，
+会被误判为降档无效。
+
+直接运行本文件可在模拟的带宽变化下查看控制器的决策:
+    python rate_control.py
+"""
+import collections
+
+SUPPORTED_RATES = (8000, 16000, 24000, 48000)
+DOWN_BELOW = 1.1          # 到达速度低于实时的 1.1 倍 (或出现欠载) 时降档
+DOWN_TARGET = 1.3         # 降档时选择预计到达速度不低于该值的最高采样率
+UP_ABOVE = 1.6            # 按比例换算到高一档后仍不低于该值才升档
+UP_STREAK = 3             # 升档需要连续满足的句数
+MIN_AUDIO_SECONDS = 0.8   # 太短的句子测量误差大，不参与决策
+MAX_RATIO = 20.0
+HOLD_UTTERANCES = 10      # 降档无效 (瓶颈不在带宽) 时恢复原采样率，并在这些句子内不再降档
+
+
+class SampleRateController:
+    def __init__(self, initial=24000, rates=SUPPORTED_RATES, max_rate=None):
+        self.rates = sorted(r for r in rates if max_rate is None or r <= max_rate)
+        if not self.rates:
+            raise ValueError(f'没有可用的采样率: rates={rates}, max_rate={max_rate}')
+        self.rate = initial if initial in self.rates else self.rates[-1]
+        self.switches = 0
+        self._streak = 0
+        self._hold = 0
+        self._last_down = None  # (降档前的采样率, 降档前的到达速度)
+
+    @staticmethod
+    def arrival_ratio(audio_seconds, network_seconds):
+        """音频到达速度相对实时的倍数"""
+        if network_seconds <= 0:
+            return MAX_RATIO
+        return min(audio_seconds / network_seconds, MAX_RATIO)
+
+    def update(self, audio_seconds, network_seconds, underruns=0, rate=None):
+        """
+        一句结束时调用，rate 为该句请求时的采样率 (默认为当前采样率)。
+        返回 (之后请求使用的采样率, 决策说明)，不切换时说明为 None
+        """
+        if rate is not None and rate != self.rate:
+            # 切换前已提前请求的句子，不能反映当前采样率下的到达速度
+            return self.rate, None
+        if audio_seconds < MIN_AUDIO_SECONDS:
+            return self.rate, None
+        ratio = self.arrival_ratio(audio_seconds, network_seconds)
+        current = self.rate
+        if self._hold:
+            self._hold -= 1
+
+        # 上一次降档后速度没有按比例提高，说明瓶颈不在带宽，降档只会损失音质
+        if self._last_down is not None:
+            previous_rate, previous_ratio = self._last_down
+            self._last_down = None
+            expected = previous_ratio * previous_rate / current
+            if ratio < previous_ratio + (expected - previous_ratio) / 2:
+                self._hold = HOLD_UTTERANCES
+                return self._switch(previous_rate, f'降档后到达速度 {previous_ratio:.2f}x -> {ratio:.2f}x '
+                                                   f'(预期 {expected:.2f}x)，瓶颈不在带宽，恢复')
+
+        if (ratio < DOWN_BELOW or underruns) and not self._hold:
+            lower = [r for r in self.rates if r < current]
+            if lower:
+                # 带宽受限时到达速度与采样率成反比
+                target = next((r for r in reversed(lower) if ratio * current / r >= DOWN_TARGET), lower[0])
+                self._last_down = (current, ratio)
+                return self._switch(target, f'到达速度 {ratio:.2f}x, 欠载 {underruns} 次')
+
+        higher = [r for r in self.rates if r > current]
+        if higher and not underruns and ratio * current / higher[0] >= UP_ABOVE:
+            self._streak += 1
+            if self._streak >= UP_STREAK:
+                return self._switch(higher[0], f'连续 {self._streak} 句到达速度充足 ({ratio:.2f}x)')
+        else:
+            self._streak = 0
+        return self.rate, None
+
+    def _switch(self, rate, reason):
+        self.rate = rate
+        self.switches += 1
+        self._streak = 0
+        return rate, reason
+
+
+# ======= 模拟 =======
+def simulate(bandwidths, utterance_seconds=3.0, server_speed=8.0, max_rate=24000, pool_size=2):
+    """
+    bandwidths 为每句话期间的链路带宽 (字节/秒)。server_speed 为服务端生成速度 (实时倍数)，
+    两者中较慢的一个决定到达速度。max_rate 与 pool_size 与程序的默认值一致:
+    最高为设备采样率 (qwen3tts.TTS_SAMPLE_RATE)，每句在前 pool_size-1 句播放时就已请求
+    """
+    controller = SampleRateController(max_rate=max_rate)
+    requested = collections.deque([controller.rate] * (pool_size - 1))
+    for i, bandwidth in enumerate(bandwidths):
+        # 本句开始播放时请求后面第 pool_size-1 句，播放的是更早请求的句子
+        requested.append(controller.rate)
+        rate = requested.popleft()
+        ratio = min(bandwidth / (rate * 2), server_speed)
+        underruns = 0 if ratio >= 1.0 else int((1 - ratio) * utterance_seconds / 0.02)
+        new_rate, reason = controller.update(utterance_seconds, utterance_seconds / ratio, underruns, rate)
+        line = f'{i:>3} bandwidth={bandwidth / 1000:>5.0f}KB/s rate={rate:>5} arrival={ratio:>5.2f}x underruns={underruns:>3}'
+        if reason:
+            line += f'  -> {new_rate}Hz ({reason})'
+        print(line)
+    return controller
+
+
+if __name__ == '__main__':
+    # 带宽: 充足 -> 骤降到 30KB/s -> 恢复
+    simulate([200000] * 3 + [30000] * 6 + [200000] * 10, server_speed=8.0)
+    print()
+    # 服务端本身偏慢 (与带宽无关) 时，降档无效并恢复
+    simulate([200000] * 15, server_speed=0.9)
@@ -0,0 +1,237 @@
+# coding=utf-8
+"""
+基于 NumPy 的时间伸缩 (WSOLA)，用于 TTS 播放落后时加速追赶。
+
+- TimeStretcher: 流式 WSOLA，逐块输入 int16 PCM，按给定倍速输出，不改变音高
+- CatchUpController: 根据当前延迟计算播放倍速，延迟回到目标后恢复 1.0x (带滞回)
+
+直接运行本文件可得到 CPU 开销基准与延迟-时间轨迹:
+    python tsm.py [--trace lag_trace.csv]
+"""
+import argparse
+import collections
+import csv
+import time
+
+import numpy as np
+
+# ======= 默认参数 (24kHz) =======
+DEFAULT_FRAME = 960        # 分析帧长 40ms
+DEFAULT_TOLERANCE = 240    # 相似度搜索范围 ±10ms
+DEFAULT_MIN_SPEED = 1.0
+DEFAULT_MAX_SPEED = 1.5
+DEFAULT_TARGET_LAG = 1.5   # 目标延迟 (秒)，低于此值恢复正常速度
+DEFAULT_GAIN = 0.25        # 每超出 1 秒延迟增加的倍速
+DEFAULT_ENGAGE_LAG = 0.5   # 延迟超出目标该值后才开始加速，避免在目标附近反复启停
+DEFAULT_MIN_STEP = 0.05    # 加速期间倍速至少为 1 + 该值，保证有限时间内回到目标
+TRACE_MAXLEN = 100000      # 延迟轨迹最多保留的点数，避免长时间运行时无限增长
+
+
+class TimeStretcher:
+    """
+    流式 WSOLA 时间伸缩。speed > 1 加速播放，speed == 1 原速 (按自然位置取帧，输出与输入相同)
+    """
+    def __init__(self, frame=DEFAULT_FRAME, tolerance=DEFAULT_TOLERANCE):
+        self.frame = frame
+        self.hop = frame // 2
+        self.tolerance = tolerance
+        # 周期汉宁窗在 50% 重叠时叠加为常数 1
+        self._window = (0.5 - 0.5 * np.cos(2 * np.pi * np.arange(frame) / frame)).astype(np.float32)
+        self.reset()
+
+    def reset(self):
+        self._buf = np.zeros(0, dtype=np.float32)
+        self._pos = 0.0            # 下一帧的名义分析位置 (相对 _buf)
+        self._prev = None          # 上一帧实际起点 (相对 _buf)
+        self._tail = np.zeros(self.hop, dtype=np.float32)
+
+    @property
+    def active(self):
+        """是否有尚未输出的内部状态"""
+        return self._prev is not None or len(self._buf) > 0
+
+    def process(self, pcm, speed):
+        """输入 int16 PCM 字节，返回伸缩后的 int16 PCM 字节"""
+        samples = np.frombuffer(pcm, dtype=np.int16).astype(np.float32)
+        self._buf = np.concatenate((self._buf, samples))
+
+        frame, hop, tol = self.frame, self.hop, self.tolerance
+        out = []
+        while True:
+            nominal = int(round(self._pos))
+            if self._prev is None:
+                if len(self._buf) < nominal + frame:
+                    break
+                start = nominal
+            elif speed <= 1.0:
+                # 原速时不做相似度搜索: 周期性强的语音可能匹配到相邻基音周期，导致丢失或重复样本
+                start = self._prev + hop
+                if len(self._buf) < start + frame:
+                    break
+                self._pos = float(start)
+            else:
+                natural = self._prev + hop
+                lo = max(nominal - tol, 0)
+                hi = nominal + tol
+                if len(self._buf) < max(hi, natural) + frame:
+                    break
+                start = lo + self._best_offset(natural, lo, hi)
+
+            grain = self._buf[start:start + frame] * self._window
+            if self._prev is None:
+                # 首帧前半段没有可重叠的尾部，直接输出原始样本
+                out.append(self._buf[start:start + hop].copy())
+            else:
+                out.append(self._tail + grain[:hop])
+            self._tail = grain[hop:].copy()
+            self._prev = start
+            self._pos += hop * speed
+
+        # 丢弃之后不再需要的样本
+        if self._prev is not None:
+            cut = min(self._prev + hop, int(self._pos) - tol)
+            if cut > 0:
+                self._buf = self._buf[cut:]
+                self._prev -= cut
+                self._pos -= cut
+
+        return _to_pcm(out)
+
+    def flush(self):
+        """输出剩余样本 (句子结束时调用)，并重置状态"""
+        if self._prev is None:
+            rest = self._buf
+        else:
+            # 上一帧之后尚未输出的部分按原速接在重叠尾部之后 (淡入与尾部淡出互补)
+            rest = self._buf[self._prev + self.hop:].copy()
+            if len(rest) < self.hop:
+                faded = self._tail.copy()
+                faded[:len(rest)] += rest * self._window[:len(rest)]
+                rest = faded
+            else:
+                rest[:self.hop] = self._tail + rest[:self.hop] * self._window[:self.hop]
+        self.reset()
+        return _to_pcm([rest])
+
+    def _best_offset(self, natural, lo, hi):
+        """在 [lo, hi] 内寻找与自然延续段最相似的帧起点 (归一化互相关)"""
+        template = self._buf[natural:natural + self.frame]
+        region = self._buf[lo:hi + self.frame]
+        corr = np.correlate(region, template, mode='valid')
+        energy = np.cumsum(np.concatenate(([0.0], region * region)))
+        norm = np.sqrt(energy[self.frame:] - energy[:-self.frame]) + 1e-6
+        return int(np.argmax(corr / norm))
+
+
+def _to_pcm(chunks):
+    if not chunks:
+        return b''
+    data = np.concatenate(chunks) if len(chunks) > 1 else chunks[0]
+    return np.clip(data, -32768, 32767).astype(np.int16).tobytes()
+
+
+class CatchUpController:
+    """
+    按延迟比例计算播放倍速:
+        speed = 1 + gain * (lag - target_lag)，限制在 [min_speed + min_step, max_speed]
+    延迟超过 target_lag + engage_lag 时开始加速，回到 target_lag 以下时恢复为 min_speed (默认 1.0)。
+    单纯的比例控制在目标附近倍速趋近 1.0 却永远到不了，伸缩器会一直运行
+    """
+    def __init__(self, min_speed=DEFAULT_MIN_SPEED, max_speed=DEFAULT_MAX_SPEED,
+                 target_lag=DEFAULT_TARGET_LAG, gain=DEFAULT_GAIN,
+                 engage_lag=DEFAULT_ENGAGE_LAG, min_step=DEFAULT_MIN_STEP):
+        self.min_speed = min_speed
+        self.max_speed = max_speed
+        self.target_lag = target_lag
+        self.gain = gain
+        self.engage_lag = engage_lag
+        self.min_step = min_step
+        self.speed = min_speed
+        self.engaged = False
+        self.trace = collections.deque(maxlen=TRACE_MAXLEN)  # (时间, 延迟, 倍速)
+        self._t0 = time.perf_counter()
+
+    def update(self, lag, now=None):
+        if now is None:
+            now = time.perf_counter() - self._t0
+        if self.engaged:
+            self.engaged = lag > self.target_lag
+        else:
+            self.engaged = lag > self.target_lag + self.engage_lag
+        if self.engaged:
+            speed = 1.0 + self.gain * (lag - self.target_lag)
+            self.speed = min(max(speed, self.min_speed + self.min_step), self.max_speed)
+        else:
+            self.speed = self.min_speed
+        self.trace.append((now, lag, self.speed))
+        return self.speed
+
+    def dump_trace(self, path):
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['time_s', 'lag_s', 'speed'])
+            for t, lag, speed in self.trace:
+                writer.writerow([f'{t:.3f}', f'{lag:.3f}', f'{speed:.3f}'])
+        print(f'[TSM] 延迟轨迹已保存至: {path}')
+
+
+# ======= 基准与仿真 =======
+def _synthetic_speech(seconds, rate=24000):
+    """生成带音高变化和音节包络的合成语音"""
+    t = np.arange(int(seconds * rate)) / rate
+    f0 = 140 + 30 * np.sin(2 * np.pi * 0.7 * t)
+    phase = 2 * np.pi * np.cumsum(f0) / rate
+    voice = sum(np.sin(k * phase) / k for k in range(1, 8))
+    envelope = 0.5 + 0.5 * np.sin(2 * np.pi * 4 * t)
+    return (voice * envelope * 6000).astype(np.int16)
+
+
+def benchmark(seconds=10.0, speed=1.25, chunk=2400, rate=24000):
+    """每秒 24kHz 音频的 CPU 耗时 (毫秒)"""
+    pcm = _synthetic_speech(seconds, rate).tobytes()
+    stretcher = TimeStretcher()
+    step = chunk * 2
+    out_len = 0
+    cpu0 = time.process_time()
+    for i in range(0, len(pcm), step):
+        out_len += len(stretcher.process(pcm[i:i + step], speed))
+    out_len += len(stretcher.flush())
+    cpu = time.process_time() - cpu0
+    print(f'[TSM] speed={speed:.2f}x, input={seconds:.1f}s, output={out_len / 2 / rate:.2f}s, '
+          f'cpu={cpu * 1000 / seconds:.2f} ms per second of audio')
+    return cpu / seconds
+
+
+def simulate_lag(utterances=6, utterance_seconds=3.0, initial_lag=4.0, chunk_seconds=0.1):
+    """
+    仿真积压时的追赶过程: 多句排队导致 initial_lag 秒延迟，
+    按控制器倍速播放，返回记录了延迟-时间轨迹的控制器
+    """
+    controller = CatchUpController()
+    lag = initial_lag
+    now = 0.0
+    for _ in range(utterances):
+        played = 0.0
+        while played < utterance_seconds:
+            speed = controller.update(lag, now)
+            wall = chunk_seconds / speed
+            # 墙钟走过 wall 秒，播放了 chunk_seconds 秒的原始音频
+            lag -= chunk_seconds - wall
+            now += wall
+            played += chunk_seconds
+    return controller
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='WSOLA 时间伸缩基准')
+    parser.add_argument('--trace', help='保存仿真延迟轨迹的 CSV 路径')
+    args = parser.parse_args()
+
+    for s in (1.0, 1.25, 1.5):
+        benchmark(speed=s)
+
+    controller = simulate_lag()
+    for t, lag, speed in list(controller.trace)[::10]:
+        print(f'[TSM] t={t:7.3f}s lag={lag:5.2f}s speed={speed:.2f}x')
+    if args.trace:
+        controller.dump_trace(args.trace)
@@ -0,0 +1,264 @@
+# coding=utf-8
+"""
+声音复刻样本预处理。
+
+用户选择的样本常常是几分钟长、高码率的录音，整段 base64 上传很慢。这里在上传前:
+1. 解码并下混为单声道、重采样到 ENROLL_SAMPLE_RATE (有 ffmpeg 时由 ffmpeg 完成，
+   否则只支持 WAV，使用 resample.Resampler 按块处理)；
+2. 去掉首尾静音，按 20ms 帧的能量选出语音最多的一段 (不超过 ENROLL_MAX_SECONDS)；
+3. 重新编码为紧凑格式 (有 ffmpeg 时为 MP3，否则为 16bit WAV)；
+4. 请求体以文件对象的形式边读边做 base64 编码，内存中只保留编码后的音频一份。
+
+无法解码时 (例如没有 ffmpeg 的 mp3/m4a) 返回 None，调用方退回上传原文件。低采样率的 WAV
+或低码率的短 MP3 处理后可能比原文件更大，调用方比较大小后同样上传原文件。
+
+直接运行本文件可查看预处理效果，并可选择对比原文件与预处理后的注册耗时:
+    python voice_prep.py voice.mp3 --out prepared.mp3
+    python voice_prep.py voice.mp3 --enroll   # 会创建两个音色
+"""
+import argparse
+import base64
+import io
+import json
+import os
+import shutil
+import subprocess
+import time
+import wave
+
+import numpy as np
+
+from resample import Resampler
+
+ENROLL_SAMPLE_RATE = 24000  # 复刻服务要求采样率不低于 24kHz
+ENROLL_MAX_SECONDS = 20.0   # 服务推荐 10~20 秒，更长的样本不会提升效果
+ENROLL_MP3_BITRATE = '64k'
+FRAME_SECONDS = 0.02
+EDGE_PAD_SECONDS = 0.2      # 去静音时在语音前后保留的余量
+SPEECH_ABOVE_FLOOR_DB = 10  # 比噪声底高出该值的帧视为语音
+SPEECH_BELOW_PEAK_DB = 45   # 同时不低于峰值减去该值
+READ_BLOCK_BYTES = 64 * 1024
+BASE64_BLOCK_BYTES = 6 * 1024  # 3 的倍数，分块编码结果可直接拼接；编码后恰为 8KB，与发送块大小一致
+
+
+class PreparedSample:
+    """预处理结果: 编码后的音频及统计信息"""
+    def __init__(self, data, mime_type, source_bytes, source_seconds, seconds, prep_seconds):
+        self.data = data
+        self.mime_type = mime_type
+        self.source_bytes = source_bytes
+        self.source_seconds = source_seconds
+        self.seconds = seconds
+        self.prep_seconds = prep_seconds
+
+
+def _ffmpeg():
+    return shutil.which('ffmpeg')
+
+
+def _decode_ffmpeg(path, rate):
+    """由 ffmpeg 解码、下混并重采样。stdout 与 stderr 同时读取，输出较多的 stderr 不会写满管道而卡住"""
+    proc = subprocess.run([_ffmpeg(), '-v', 'error', '-i', path, '-ac', '1', '-ar', str(rate),
+                           '-f', 's16le', '-'], capture_output=True)
+    if proc.returncode != 0:
+        raise RuntimeError(f'ffmpeg 解码失败: {proc.stderr.decode("utf-8", "replace").strip()}')
+    return np.frombuffer(proc.stdout, dtype=np.int16)
+
+
+def _wav_block_to_mono(raw, sampwidth, channels):
+    if sampwidth == 1:
+        x = (np.frombuffer(raw, dtype=np.uint8).astype(np.float32) - 128) * 256
+    elif sampwidth == 2:
+        x = np.frombuffer(raw, dtype='<i2').astype(np.float32)
+    elif sampwidth == 3:
+        b = np.frombuffer(raw, dtype=np.uint8).reshape(-1, 3).astype(np.int32)
+        v = b[:, 0] | (b[:, 1] << 8) | (b[:, 2] << 16)
+        x = (np.where(v & 0x800000, v - 0x1000000, v) / 256).astype(np.float32)
+    elif sampwidth == 4:
+        x = (np.frombuffer(raw, dtype='<i4') / 65536).astype(np.float32)
+    else:
+        raise ValueError(f'不支持的 WAV 位深: {sampwidth * 8}bit')
+    return x.reshape(-1, channels).mean(axis=1)
+
+
+def _decode_wav(path, rate):
+    """不依赖 ffmpeg 的 WAV 解码: 按块下混并重采样"""
+    with wave.open(path, 'rb') as wf:
+        channels, sampwidth = wf.getnchannels(), wf.getsampwidth()
+        resampler = Resampler(wf.getframerate(), rate)
+        pcm = bytearray()
+        frames_per_block = max(READ_BLOCK_BYTES // (sampwidth * channels), 1)
+        while True:
+            raw = wf.readframes(frames_per_block)
+            if not raw:
+                break
+            pcm += _to_int16(resampler.process(_wav_block_to_mono(raw, sampwidth, channels)))
+        pcm += _to_int16(resampler.flush())
+    return np.frombuffer(pcm, dtype=np.int16)
+
+
+def _to_int16(samples):
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16).tobytes()
+
+
+def decode(path, rate=ENROLL_SAMPLE_RATE):
+    """解码为单声道 16bit 样本 (np.int16)；无法解码时打印原因并返回 None"""
+    if _ffmpeg():
+        return _decode_ffmpeg(path, rate)
+    if path.lower().endswith('.wav'):
+        return _decode_wav(path, rate)
+    print(f'[Warning] 未找到 ffmpeg，无法解码 {os.path.basename(path)} (没有 ffmpeg 时只支持 WAV)。'
+          f'该样本将不经预处理直接上传，安装 ffmpeg 并加入 PATH 后可截取、压缩样本以缩短复刻耗时')
+    return None
+
+
+def select_window(samples, rate=ENROLL_SAMPLE_RATE, max_seconds=ENROLL_MAX_SECONDS):
+    """
+    去掉首尾静音，并在不超过 max_seconds 的窗口中选出语音帧最多的一段，
+    返回 (start, end) 样本下标
+    """
+    frame = int(rate * FRAME_SECONDS)
+    n_frames = len(samples) // frame
+    if n_frames == 0:
+        return 0, len(samples)
+    frames = samples[:n_frames * frame].reshape(n_frames, frame).astype(np.float32)
+    db = 10 * np.log10(np.mean(frames * frames, axis=1) + 1.0)
+    threshold = max(np.percentile(db, 10) + SPEECH_ABOVE_FLOOR_DB, db.max() - SPEECH_BELOW_PEAK_DB)
+    speech = db > threshold
+    if not speech.any():
+        return 0, min(len(samples), int(max_seconds * rate))
+
+    pad = int(EDGE_PAD_SECONDS / FRAME_SECONDS)
+    first = max(int(np.argmax(speech)) - pad, 0)
+    last = min(n_frames - int(np.argmax(speech[::-1])) + pad, n_frames)
+    window = int(max_seconds / FRAME_SECONDS)
+    if last - first <= window:
+        return first * frame, min(last * frame, len(samples))
+
+    # 滑动窗口内语音帧数，相同时取能量更高的窗口
+    score = speech[first:last] + np.maximum(db[first:last] - threshold, 0) / 1000
+    sums = np.concatenate(([0.0], np.cumsum(score)))
+    best = first + int(np.argmax(sums[window:] - sums[:-window]))
+    return best * frame, (best + window) * frame
+
+
+def _encode_wav(samples, rate):
+    buf = io.BytesIO()
+    with wave.open(buf, 'wb') as wf:
+        wf.setnchannels(1)
+        wf.setsampwidth(2)
+        wf.setframerate(rate)
+        wf.writeframes(samples.tobytes())
+    return buf.getvalue(), 'audio/wav'
+
+
+def _encode_mp3(samples, rate):
+    proc = subprocess.run([_ffmpeg(), '-v', 'error', '-f', 's16le', '-ac', '1', '-ar', str(rate),
+                           '-i', '-', '-b:a', ENROLL_MP3_BITRATE, '-f', 'mp3', '-'],
+                          input=samples.tobytes(), capture_output=True)
+    if proc.returncode != 0 or not proc.stdout:
+        raise RuntimeError(f'ffmpeg 编码失败: {proc.stderr.decode("utf-8", "replace").strip()}')
+    return proc.stdout, 'audio/mpeg'
+
+
+def prepare(path, rate=ENROLL_SAMPLE_RATE, max_seconds=ENROLL_MAX_SECONDS):
+    """预处理声音样本，返回 PreparedSample；无法解码时返回 None"""
+    t0 = time.perf_counter()
+    samples = decode(path, rate)
+    if samples is None:
+        return None
+    start, end = select_window(samples, rate, max_seconds)
+    window = samples[start:end]
+    data, mime_type = None, None
+    if _ffmpeg():
+        try:
+            data, mime_type = _encode_mp3(window, rate)
+        except Exception as e:
+            print(f'[Warning] {e}，改用 WAV')
+    if data is None:
+        data, mime_type = _encode_wav(window, rate)
+    return PreparedSample(data, mime_type, os.path.getsize(path), len(samples) / rate,
+                          len(window) / rate, time.perf_counter() - t0)
+
+
+def base64_size(n):
+    return 4 * ((n + 2) // 3)
+
+
+class DataUriBody:
+    """
+    以文件对象形式提供的 JSON 请求体，其中的 data URI 在读取时分块 base64 编码。
+    requests 通过 __len__ 设置 Content-Length，并按块 read() 发送
+    """
+    PLACEHOLDER = '@@AUDIO_DATA_URI@@'
+
+    def __init__(self, payload, audio, mime_type):
+        """payload 中值为 DataUriBody.PLACEHOLDER 的字段会被替换为 data URI"""
+        text = json.dumps(payload, ensure_ascii=False)
+        prefix, suffix = text.split(self.PLACEHOLDER)
+        self._prefix = (prefix + f'data:{mime_type};base64,').encode('utf-8')
+        self._suffix = suffix.encode('utf-8')
+        self._audio = memoryview(audio)
+        self._length = len(self._prefix) + base64_size(len(audio)) + len(self._suffix)
+        self._chunks = self._generate()
+        self._pending = b''
+
+    def __len__(self):
+        return self._length
+
+    def _generate(self):
+        yield self._prefix
+        for i in range(0, len(self._audio), BASE64_BLOCK_BYTES):
+            yield base64.b64encode(self._audio[i:i + BASE64_BLOCK_BYTES])
+        yield self._suffix
+
+    def read(self, size=-1):
+        parts = [self._pending]
+        n = len(self._pending)
+        while size < 0 or n < size:
+            chunk = next(self._chunks, None)
+            if chunk is None:
+                break
+            parts.append(chunk)
+            n += len(chunk)
+        data = b''.join(parts)
+        if size < 0:
+            self._pending = b''
+            return data
+        self._pending = data[size:]
+        return data[:size]
+
+
+# ======= 命令行 =======
+def _print_summary(sample):
+    print(f'[Enroll] 原始样本 {sample.source_bytes / 1024:.0f}KB ({sample.source_seconds:.1f}s) -> '
+          f'{sample.mime_type} {len(sample.data) / 1024:.0f}KB ({sample.seconds:.1f}s), '
+          f'预处理 {sample.prep_seconds * 1000:.0f}ms')
+    print(f'[Enroll] 上传数据 {base64_size(sample.source_bytes) / 1024:.0f}KB -> '
+          f'{base64_size(len(sample.data)) / 1024:.0f}KB')
+    if len(sample.data) >= sample.source_bytes:
+        print('[Enroll] 预处理结果不比原文件小，注册时将上传原文件')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='声音复刻样本预处理')
+    parser.add_argument('path')
+    parser.add_argument('--out', help='保存预处理后的音频')
+    parser.add_argument('--enroll', action='store_true',
+                        help='分别用原文件和预处理结果注册音色并对比耗时 (会创建两个音色)')
+    args = parser.parse_args()
+
+    prepared = prepare(args.path)
+    if prepared is None:
+        raise SystemExit('无法解码该文件 (mp3/m4a 需要 ffmpeg)')
+    _print_summary(prepared)
+    if args.out:
+        with open(args.out, 'wb') as f:
+            f.write(prepared.data)
+        print(f'[Enroll] 已保存至: {args.out}')
+    if args.enroll:
+        from qwen3tts import enroll_voice
+        for label, prep in (('原文件', False), ('预处理', True)):
+            t0 = time.perf_counter()
+            voice_id = enroll_voice(args.path, preprocess=prep)
+            print(f'[Enroll] {label}: {time.perf_counter() - t0:.2f}s, voice={voice_id}')